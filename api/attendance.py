@@ -0,0 +1,155 @@
+"""
+Attendance ledger: check-ins are written to Postgres synchronously and the
+Google Sheet is brought up to date by a coalescing background flush, so a
+burst of check-ins becomes one Sheets batch write. One instance flushes a
+week at a time (a Postgres advisory lock). Failed or contended flushes are
+retried with backoff from a timer rather than on the shared deferred worker
+(and by the /api/flush cron); after FLUSH_MAX_ATTEMPTS their recorders are
+told through the `on_flush_failure` handlers.
+"""
+import os
+import threading
+import datetime as dt
+from contextlib import nullcontext
+
+from flask import current_app, has_app_context
+
+from api.db import record_attendance, fetch_unflushed_weeks, fetch_unflushed_attendance, \
+    fetch_unflushed_names, mark_attendance_flushed, record_flush_failure, attendance_flush_lock
+from api.deferred import deferred
+
+try:
+    from zoneinfo import ZoneInfo
+    _TZ = ZoneInfo(os.getenv("ATTENDANCE_TIMEZONE", "Asia/Taipei"))
+except Exception:  # pragma: no cover
+    _TZ = None
+
+# Seconds before the first retry of a failed or contended flush; doubles after.
+FLUSH_RETRY_DELAY = float(os.getenv("ATTENDANCE_FLUSH_RETRY_DELAY", "2"))
+# Failed flushes per ledger row before it is given up on.
+FLUSH_MAX_ATTEMPTS = int(os.getenv("ATTENDANCE_FLUSH_ATTEMPTS", "3"))
+
+_flush_scheduled = False
+_flush_lock = threading.Lock()
+_failure_handlers = []
+
+
+def on_flush_failure(fn):
+    "Register `fn({recorded_by: [name]})`, called once rows run out of flush attempts."
+    _failure_handlers.append(fn)
+    return fn
+
+
+def current_week_start(now=None):
+    "Monday of the current week in the sheet's timezone."
+    now = now or dt.datetime.now(_TZ)
+    today = now.date()
+    return today - dt.timedelta(days=today.weekday())
+
+
+def record_checkin(states, recorded_by):
+    "Write {name: state} to the ledger and schedule a sheet flush."
+    from api.gsheet import record_pending_states
+
+    record_attendance(current_week_start(), states, recorded_by)
+    try:
+        record_pending_states(states)
+    except Exception as e:
+        print(f"sheet snapshot update failed: {e!r}")
+    schedule_flush()
+
+
+def unflushed_names(names):
+    "Names whose latest check-in this week may not be in the sheet (or its snapshot) yet."
+    if not names:
+        return set()
+    return fetch_unflushed_names(current_week_start(), names)
+
+
+def schedule_flush():
+    """
+    Queue a flush unless one is already waiting; that one will pick up our
+    rows, since it reads the ledger only when it runs.
+    """
+    global _flush_scheduled
+    with _flush_lock:
+        if _flush_scheduled:
+            return
+        _flush_scheduled = True
+    app = current_app._get_current_object() if has_app_context() else None
+    deferred.submit(_run_flush, app)
+
+
+def _run_flush(app, attempt=0):
+    global _flush_scheduled
+    if attempt == 0:
+        with _flush_lock:
+            _flush_scheduled = False
+    with app.app_context() if app is not None else nullcontext():
+        try:
+            results, busy = _flush_weeks(fetch_unflushed_weeks(FLUSH_MAX_ATTEMPTS))
+            retry = busy or not all(results.values())
+        except Exception as e:
+            print(f"Attendance flush failed: {e!r}")
+            retry = True
+    if retry and attempt + 1 < FLUSH_MAX_ATTEMPTS:
+        _retry_later(app, attempt + 1)
+
+
+def _retry_later(app, attempt):
+    "Re-queue the flush after a backoff without holding the deferred worker meanwhile."
+    timer = threading.Timer(FLUSH_RETRY_DELAY * 2 ** (attempt - 1), deferred.submit, (_run_flush, app, attempt))
+    timer.daemon = True
+    timer.start()
+
+
+def flush_to_sheet(week_start=None):
+    """
+    Project the latest unflushed state per name into the sheet, one batch
+    write per week, for `week_start` or else every week with rows left
+    (oldest first, so the newest week wins). Returns {name: bool} for the
+    rows attempted; weeks another instance is flushing are skipped.
+    """
+    weeks = [week_start] if week_start else fetch_unflushed_weeks(FLUSH_MAX_ATTEMPTS)
+    return _flush_weeks(weeks)[0]
+
+
+def _flush_weeks(weeks):
+    "Flush each week in turn; returns ({name: bool}, whether any week was locked)."
+    results = {}
+    busy = False
+    for week in weeks:
+        with attendance_flush_lock(week) as locked:
+            if not locked:
+                print(f"Attendance for {week} is being flushed elsewhere; skipping")
+                busy = True
+                continue
+            results.update(_flush_week(week))
+    return results, busy
+
+
+def _flush_week(week_start):
+    from api.gsheet import update_gsheet_checkboxes
+
+    states, max_id = fetch_unflushed_attendance(week_start, FLUSH_MAX_ATTEMPTS)
+    if not states:
+        return {}
+    results = update_gsheet_checkboxes(states)
+    written = [name for name, ok in results.items() if ok]
+    failed = [name for name, ok in results.items() if not ok]
+    if written:
+        mark_attendance_flushed(week_start, written, max_id)
+    if failed:
+        exhausted = record_flush_failure(week_start, failed, max_id, FLUSH_MAX_ATTEMPTS)
+        if exhausted:
+            _notify_failure(exhausted)
+    print(f"Flushed {len(written)}/{len(states)} attendance rows for {week_start} to the sheet")
+    return results
+
+
+def _notify_failure(names_by_recorder):
+    for handler in _failure_handlers:
+        try:
+            handler(names_by_recorder)
+        except Exception as e:
+            print(f"Flush failure handler failed: {e!r}")
@@ -0,0 +1,79 @@
+import os
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from linebot.exceptions import LineBotApiError
+
+from api.ratelimit import TokenBucket
+
+# LINE rejects multicast requests with more than 500 recipients.
+MULTICAST_LIMIT = 500
+
+
+def chunked(iterable, size=MULTICAST_LIMIT):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _send_chunk(line_bot_api, user_ids, messages, bucket, max_retries, base_delay):
+    attempt = 0
+    while True:
+        bucket.acquire()
+        try:
+            line_bot_api.multicast(user_ids, messages)
+            return None
+        except LineBotApiError as e:
+            if e.status_code != 429 or attempt >= max_retries:
+                return e
+        except Exception as e:
+            # Network errors fail this chunk only; the rest of the run goes on.
+            return e
+        delay = base_delay * (2 ** attempt)
+        time.sleep(delay + random.uniform(0, delay))
+        attempt += 1
+
+
+def broadcast(line_bot_api, user_id_chunks, messages, max_workers=None, rate=None, max_retries=4, base_delay=1.0):
+    """
+    Multicast `messages` to each chunk of user IDs with bounded concurrency
+    and a token-bucket rate limit, retrying 429s with jittered backoff.
+
+    Returns a summary: {"chunks", "delivered", "failed", "errors"}, where
+    delivered/failed count recipients.
+    """
+    max_workers = max_workers or int(os.getenv("BROADCAST_WORKERS", "4"))
+    bucket = TokenBucket(rate or float(os.getenv("BROADCAST_RATE", "10")))
+    summary = {"chunks": 0, "delivered": 0, "failed": 0, "errors": []}
+
+    def record(user_ids, future):
+        try:
+            error = future.result()
+        except Exception as e:
+            error = e
+        summary["chunks"] += 1
+        if error is None:
+            summary["delivered"] += len(user_ids)
+        else:
+            summary["failed"] += len(user_ids)
+            summary["errors"].append(str(error))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        # Keep at most `max_workers` chunks in flight so the cursor is read lazily.
+        in_flight = []
+        for user_ids in user_id_chunks:
+            if len(in_flight) >= max_workers:
+                record(*in_flight.pop(0))
+            future = pool.submit(_send_chunk, line_bot_api, user_ids, messages, bucket, max_retries, base_delay)
+            in_flight.append((user_ids, future))
+        for user_ids, future in in_flight:
+            record(user_ids, future)
+
+    print(f"Broadcast finished: {summary['chunks']} chunks, {summary['delivered']} delivered, {summary['failed']} failed")
+    return summary
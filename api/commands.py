@@ -0,0 +1,95 @@
+"""
+Declarative text-command registry.
+
+Commands are registered once at import with the decorator:
+
+    @commands.command("點名", scopes=("user",))
+    def handle_checkin_command(event, cmd): ...
+
+Exact commands resolve through one dict lookup; prefix commands (規劃：)
+through a dict per distinct prefix length, so adding a command doesn't slow
+down the others. `cmd.text` is the message text and `cmd.args` whatever
+follows the command word or prefix.
+"""
+import time
+import threading
+from collections import namedtuple
+
+from api.metrics import observe_handler
+
+Command = namedtuple("Command", "name handler scopes takes_args")
+CommandCall = namedtuple("CommandCall", "name text args scope")
+
+
+class CommandRegistry:
+    def __init__(self):
+        self._exact = {}
+        self._prefixes = {}  # prefix length -> {prefix: Command}
+        self._lock = threading.Lock()
+        self.stats = {}  # command name -> {"count", "total_ms", "max_ms"}
+
+    def command(self, *words, prefixes=(), scopes=("group", "user"), takes_args=False):
+        """
+        Register the decorated `handler(event, cmd)` for exact `words` and/or
+        `prefixes`, allowed in the given chat `scopes`. With `takes_args`,
+        `word <args>` also matches.
+        """
+        def register(handler):
+            cmd = Command(handler.__name__, handler, frozenset(scopes), takes_args)
+            for word in words:
+                if word in self._exact:
+                    raise ValueError(f"Command {word!r} is already registered")
+                self._exact[word] = cmd
+            for prefix in prefixes:
+                by_prefix = self._prefixes.setdefault(len(prefix), {})
+                if prefix in by_prefix:
+                    raise ValueError(f"Command prefix {prefix!r} is already registered")
+                by_prefix[prefix] = cmd
+            return handler
+        return register
+
+    def resolve(self, text, scope):
+        "Return (Command, args) for `text` in `scope`, or (None, None)."
+        cmd = self._exact.get(text)
+        args = ""
+        if cmd is None:
+            parts = text.split(None, 1)
+            if len(parts) == 2:
+                candidate = self._exact.get(parts[0])
+                if candidate is not None and candidate.takes_args:
+                    cmd, args = candidate, parts[1].strip()
+        if cmd is None:
+            stripped = text.strip()
+            for length, prefixes in self._prefixes.items():
+                candidate = prefixes.get(stripped[:length])
+                if candidate is not None:
+                    cmd, args = candidate, stripped[length:].strip()
+                    break
+        if cmd is None or scope not in cmd.scopes:
+            return None, None
+        return cmd, args
+
+    def dispatch(self, event, text, scope):
+        "Run the matching command; returns False when nothing matched."
+        cmd, args = self.resolve(text, scope)
+        if cmd is None:
+            return False
+        started = time.perf_counter()
+        try:
+            cmd.handler(event, CommandCall(cmd.name, text, args, scope))
+        finally:
+            elapsed = time.perf_counter() - started
+            self._record(cmd.name, elapsed)
+            observe_handler("command", cmd.name, elapsed)
+        return True
+
+    def _record(self, name, elapsed):
+        ms = elapsed * 1000
+        with self._lock:
+            stats = self.stats.setdefault(name, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            stats["count"] += 1
+            stats["total_ms"] += ms
+            stats["max_ms"] = max(stats["max_ms"], ms)
+
+
+commands = CommandRegistry()
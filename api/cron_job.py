@@ -1,9 +1,10 @@
 import os
-from linebot import LineBotApi
 from api.flex_messages import create_all_counter_message
 from api.db import User
+from api.broadcast import broadcast
+from api.transport import create_line_bot_api
 
-line_bot_api = LineBotApi(os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
+line_bot_api = create_line_bot_api(os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
 EVENT_DATA = [
         {'C': '主日', 'D': '禱告聚會', 'H': '小排'},
         {'E': '晨興', 'F': '家聚會', 'G': '家受訪'},
@@ -13,9 +14,9 @@ EVENT_DATA = [
 
 def send_weekly_notification():
     user = User(None, None, None)
-    user_id_list = user.fetch_all_user_ids()
-    line_bot_api.multicast(
-        user_id_list,
+    return broadcast(
+        line_bot_api,
+        user.iter_user_id_chunks(),
         create_all_counter_message(f'嗨～來週點名囉～', EVENT_DATA, state="")
     )
 
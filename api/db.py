@@ -1,75 +1,458 @@
 import pg8000.dbapi
 import os
+import time
+import threading
+from contextlib import contextmanager
+
+from api.metrics import span
 
 # from dotenv import load_dotenv
 # load_dotenv()
 
 
+def connect_db():
+    conn = pg8000.dbapi.connect(
+        user=os.getenv('POSTGRES_USER'),
+        password=os.getenv('POSTGRES_PASSWORD'),
+        database=os.getenv('POSTGRES_DATABASE'),
+        host=os.getenv('POSTGRES_HOST'),
+        port=5432
+    )
+    return conn
+
+
+class ConnectionPool:
+    """
+    Small bounded pool of pg8000 connections, shared by every request that
+    lands on the same warm instance. Connections idle longer than
+    `idle_timeout` are closed; ones idle longer than `health_check_after`
+    are pinged with `SELECT 1` before being handed out.
+    """
+    def __init__(self, connect=connect_db, max_size=4, idle_timeout=300, health_check_after=30, acquire_timeout=10):
+        self._connect = connect
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.health_check_after = health_check_after
+        self.acquire_timeout = acquire_timeout
+        self._idle = []  # [(conn, last_used)], most recently used last
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+
+    def _evict_idle(self, now):
+        expired = [c for c, last in self._idle if now - last > self.idle_timeout]
+        self._idle = [(c, last) for c, last in self._idle if now - last <= self.idle_timeout]
+        return expired
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise RuntimeError("Timed out waiting for a database connection.")
+        try:
+            while True:
+                now = time.monotonic()
+                with self._lock:
+                    expired = self._evict_idle(now)
+                    conn, last_used = self._idle.pop() if self._idle else (None, None)
+                for c in expired:
+                    _close_quietly(c)
+                if conn is None:
+                    return self._connect()
+                if now - last_used < self.health_check_after or self._is_healthy(conn):
+                    return conn
+                _close_quietly(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken=False):
+        try:
+            if broken:
+                _close_quietly(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection. Whatever the caller didn't commit is rolled back
+        before it returns to the pool (pg8000 opens a transaction for every
+        statement, reads included), so idle connections hold no locks. That
+        includes a GeneratorExit from a streaming caller closed early.
+        """
+        with span("postgres", "acquire"):
+            conn = self.acquire()
+        try:
+            yield _TimedConnection(conn)
+        finally:
+            try:
+                conn.rollback()
+                broken = False
+            except Exception:
+                broken = True
+            self.release(conn, broken=broken)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            _close_quietly(conn)
+
+
+class _TimedCursor:
+    "Cursor wrapper that times each statement, not the time the connection is held."
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, *args, **kwargs):
+        with span("postgres", "query"):
+            return self._cursor.execute(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class _TimedConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return _TimedCursor(self._conn.cursor())
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _prepared(conn, sql):
+    """
+    Server-side prepared statement for `sql` on a pooled connection, PARSEd
+    the first time that connection runs it. Outside an explicit transaction
+    each run() commits by itself, with no BEGIN/COMMIT round trips.
+    """
+    from pg8000.native import PreparedStatement
+
+    raw = getattr(conn, '_conn', conn)
+    statements = getattr(raw, '_prepared_statements', None)
+    if statements is None:
+        statements = raw._prepared_statements = {}
+    statement = statements.get(sql)
+    if statement is None:
+        with span("postgres", "prepare"):
+            statement = statements[sql] = PreparedStatement(raw, sql)
+    return _TimedStatement(statement)
+
+
+class _TimedStatement:
+    def __init__(self, statement):
+        self._statement = statement
+
+    def run(self, **params):
+        with span("postgres", "query"):
+            return self._statement.run(**params)
+
+
+_USERS_UPSERT = (
+    "INSERT INTO users (user_id, group_id, name) VALUES (:user_id, :group_id, :name) "
+    "ON CONFLICT (user_id) DO NOTHING RETURNING user_id"
+)
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(max_size=int(os.getenv('POSTGRES_POOL_SIZE', '4')))
+    return _pool
+
+
 class User:
     "Class for storing functions related to users"
-    def __init__(self, user_id, group_id, name):
+    def __init__(self, user_id, group_id, name, pool=None):
         self.user_id = user_id
         self.group_id = group_id
         self.name = name
-        self.conn = self.connect_db()
-        self.cursor = self.conn.cursor()
-    
-    def connect_db(self):
-        conn = pg8000.dbapi.connect(
-            user=os.getenv('POSTGRES_USER'),
-            password=os.getenv('POSTGRES_PASSWORD'),
-            database=os.getenv('POSTGRES_DATABASE'),
-            host=os.getenv('POSTGRES_HOST'),
-            port=5432
-        )
-        return conn
+        self.pool = pool or get_pool()
 
     def fetch_all_user_ids(self):
-        self.cursor.execute(
-            "SELECT user_id FROM users"
-        )
-        result = self.cursor.fetchall()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT user_id FROM users"
+            )
+            result = cursor.fetchall()
         user_id_list = [row[0] for row in result]
         return user_id_list
     
+    def iter_user_id_chunks(self, size=500):
+        "Stream distinct user_ids in lists of `size` through a server-side cursor."
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DECLARE user_id_cursor NO SCROLL CURSOR FOR SELECT DISTINCT user_id FROM users")
+            try:
+                while True:
+                    cursor.execute(f"FETCH FORWARD {int(size)} FROM user_id_cursor")
+                    rows = cursor.fetchall()
+                    if not rows:
+                        break
+                    yield [row[0] for row in rows]
+            finally:
+                cursor.execute("CLOSE user_id_cursor")
+                conn.commit()
+
     def fetch_user(self):
-        self.cursor.execute("SELECT * FROM users WHERE user_id = %s", [self.user_id])
-        user_data = self.cursor.fetchall()
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT * FROM users WHERE user_id = %s", [self.user_id])
+            user_data = cursor.fetchall()
         return user_data
     
+    def fetch_name(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name FROM users WHERE user_id = %s AND name IS NOT NULL LIMIT 1", [self.user_id])
+            row = cursor.fetchone()
+        return row[0] if row else None
+
+    def update_name(self):
+        "Store the current display name; a no-op unless it changed."
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE users SET name = %s WHERE user_id = %s AND name IS DISTINCT FROM %s",
+                [self.name, self.user_id, self.name]
+            )
+            conn.commit()
+
     def add_user(self):
-        user_data = self.fetch_user()
-        if len(user_data) == 0:
-            self.cursor.execute(
-                "INSERT INTO users (user_id, group_id, name) VALUES (%s, %s, %s)",
-                [self.user_id, self.group_id, self.name]
+        """
+        Register the user with one server-side prepared upsert: a single
+        BIND/EXECUTE round trip once the pooled connection has prepared it.
+        Relies on the unique key on users.user_id
+        (db/migrations/001_users_keys.sql).
+        """
+        with self.pool.connection() as conn:
+            rows = _prepared(conn, _USERS_UPSERT).run(
+                user_id=self.user_id, group_id=self.group_id, name=self.name
             )
-            self.conn.commit()
+            added = bool(rows)
+        if added:
             print(f"Added user_id: {self.user_id}, name: {self.name}")
         else:
             print("User exists, skipping adding user.")
-            
+        return added
 
-if __name__ == "__main__":
-    try:
-        conn = pg8000.connect(
-            user=os.getenv('POSTGRES_USER'),
-            password=os.getenv('POSTGRES_PASSWORD'),
-            database=os.getenv('POSTGRES_DATABASE'),
-            host=os.getenv('POSTGRES_HOST'),
-            port=5432
+
+def bulk_import_users(csv_file, pool=None):
+    """
+    Load users from a CSV of `user_id,group_id,name` rows. The file is COPYed
+    into a temporary table and upserted in a single statement, so thousands
+    of rows cost one round trip instead of one per user.
+    """
+    pool = pool or get_pool()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "CREATE TEMP TABLE users_import (user_id TEXT, group_id TEXT, name TEXT) ON COMMIT DROP"
+        )
+        cursor.execute("COPY users_import FROM STDIN WITH (FORMAT csv)", stream=csv_file)
+        cursor.execute(
+            "INSERT INTO users (user_id, group_id, name) "
+            "SELECT DISTINCT ON (user_id) user_id, NULLIF(group_id, ''), NULLIF(name, '') "
+            "FROM users_import WHERE user_id <> '' "
+            "ON CONFLICT (user_id) DO UPDATE SET name = COALESCE(EXCLUDED.name, users.name)"
+        )
+        count = cursor.rowcount
+        conn.commit()
+    print(f"Imported {count} users")
+    return count
+
+
+def record_attendance(week_start, states, recorded_by, pool=None):
+    "Append one ledger row per {name: state} in a single multi-row INSERT."
+    if not states:
+        return
+    pool = pool or get_pool()
+    values = []
+    params = []
+    for name, state in states.items():
+        values.append("(%s, %s, %s, %s)")
+        params += [week_start, name, state, recorded_by]
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO attendance (week_start, name, state, recorded_by) VALUES " + ", ".join(values),
+            params
+        )
+        conn.commit()
+
+
+def fetch_unflushed_weeks(max_attempts, pool=None):
+    "Weeks that still have rows to flush, oldest first."
+    pool = pool or get_pool()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT DISTINCT week_start FROM attendance "
+            "WHERE flushed_at IS NULL AND flush_attempts < %s ORDER BY week_start",
+            [max_attempts]
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+@contextmanager
+def attendance_flush_lock(week_start, pool=None):
+    """
+    Try to take the week's flush lock; yields True if this borrow holds it.
+    It is a transaction-level advisory lock, so it lasts until the pool rolls
+    the connection back when the block ends, on every instance at once.
+    """
+    pool = pool or get_pool()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT pg_try_advisory_xact_lock(hashtext('attendance_flush'), %s)",
+            [week_start.toordinal()]
+        )
+        yield cursor.fetchone()[0]
+
+
+def fetch_unflushed_attendance(week_start, max_attempts, pool=None):
+    "Latest unflushed state per name for the week, as ({name: state}, max id)."
+    pool = pool or get_pool()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT DISTINCT ON (name) name, state, "
+            "MAX(id) OVER () FROM attendance "
+            "WHERE week_start = %s AND flushed_at IS NULL AND flush_attempts < %s "
+            "ORDER BY name, id DESC",
+            [week_start, max_attempts]
+        )
+        rows = cursor.fetchall()
+    if not rows:
+        return {}, None
+    return {name: state for name, state, _ in rows}, rows[0][2]
+
+
+def fetch_unflushed_names(week_start, names, pool=None):
+    "The subset of `names` with ledger rows for the week not yet in the sheet."
+    pool = pool or get_pool()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT DISTINCT name FROM attendance "
+            "WHERE week_start = %s AND flushed_at IS NULL AND name = ANY(%s)",
+            [week_start, list(names)]
         )
-        cur = conn.cursor()
+        return {row[0] for row in cursor.fetchall()}
 
-        with open('db/users.sql') as file:
+
+def mark_attendance_flushed(week_start, names, max_id, pool=None):
+    pool = pool or get_pool()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE attendance SET flushed_at = CURRENT_TIMESTAMP "
+            "WHERE week_start = %s AND flushed_at IS NULL AND id <= %s AND name = ANY(%s)",
+            [week_start, max_id, list(names)]
+        )
+        conn.commit()
+
+
+def record_flush_failure(week_start, names, max_id, max_attempts, pool=None):
+    """
+    Count a failed flush against the names' unflushed rows. Returns
+    {recorded_by: [name]} for rows that just used up their last attempt.
+    """
+    pool = pool or get_pool()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE attendance SET flush_attempts = flush_attempts + 1 "
+            "WHERE week_start = %s AND flushed_at IS NULL AND id <= %s AND name = ANY(%s) "
+            "RETURNING recorded_by, name, flush_attempts",
+            [week_start, max_id, list(names)]
+        )
+        rows = cursor.fetchall()
+        conn.commit()
+    exhausted = {}
+    for recorded_by, name, attempts in rows:
+        if attempts == max_attempts and name not in exhausted.get(recorded_by, []):
+            exhausted.setdefault(recorded_by, []).append(name)
+    return exhausted
+
+
+def fetch_attendance_history(name, weeks=8, pool=None):
+    "Final state per past week for `name`, newest first: [(week_start, state)]."
+    pool = pool or get_pool()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT DISTINCT ON (week_start) week_start, state FROM attendance "
+            "WHERE name = %s ORDER BY week_start DESC, id DESC LIMIT %s",
+            [name, weeks]
+        )
+        return cursor.fetchall()
+
+
+def _split_sql(script):
+    # Drop comment lines first: they may contain semicolons.
+    script = '\n'.join(line for line in script.splitlines() if not line.strip().startswith('--'))
+    return [statement.strip() for statement in script.split(';') if statement.strip()]
+
+
+def migrate(conn):
+    "Apply db/users.sql and then db/migrations/*.sql in name order; every script is idempotent."
+    paths = ['db/users.sql']
+    migrations_dir = 'db/migrations'
+    if os.path.isdir(migrations_dir):
+        paths += [os.path.join(migrations_dir, f) for f in sorted(os.listdir(migrations_dir)) if f.endswith('.sql')]
+    for path in paths:
+        with open(path) as file:
             sql_script = file.read()
-        
-        with conn.cursor() as cursor:
-            cursor.execute(sql_script)
-            conn.commit()
+        cursor = conn.cursor()
+        for statement in _split_sql(sql_script):
+            cursor.execute(statement)
+        conn.commit()
+        print(f"Applied {path}")
 
-        conn.close()
+
+if __name__ == "__main__":
+    # python -m api.db                 -> create/migrate tables
+    # python -m api.db import users.csv -> bulk import user_id,group_id,name rows
+    import sys
+
+    try:
+        if len(sys.argv) >= 3 and sys.argv[1] == 'import':
+            with open(sys.argv[2], newline='') as csv_file:
+                bulk_import_users(csv_file)
+        else:
+            conn = connect_db()
+            migrate(conn)
+            conn.close()
 
     except Exception as e:
         print(f"An error occurred: {e}")
-
@@ -0,0 +1,98 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+
+
+class WebhookDeduplicator:
+    """
+    Remembers webhookEventIds for `ttl` seconds so LINE redeliveries are
+    dropped. The in-memory window is per instance; with `use_postgres` the
+    claim is also recorded in the webhook_events table so other instances
+    see it too. A claim is released again if its handler fails.
+    """
+    def __init__(self, ttl=3600, max_size=10000, use_postgres=False, pool=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.use_postgres = use_postgres
+        self.pool = pool
+        self._seen = OrderedDict()  # event_id -> expires_at
+        self._lock = threading.Lock()
+        self._claims_since_cleanup = 0
+        self.stats = {"claimed": 0, "duplicates": 0, "released": 0}
+
+    def _claim_in_memory(self, event_id, now):
+        with self._lock:
+            while self._seen:
+                oldest_id, expires_at = next(iter(self._seen.items()))
+                if expires_at > now and len(self._seen) < self.max_size:
+                    break
+                del self._seen[oldest_id]
+            if event_id in self._seen:
+                return False
+            self._seen[event_id] = now + self.ttl
+            return True
+
+    def _claim_in_postgres(self, event_id):
+        from api.db import get_pool
+
+        pool = self.pool or get_pool()
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT INTO webhook_events (event_id) VALUES (%s) "
+                "ON CONFLICT (event_id) DO NOTHING RETURNING event_id",
+                [event_id]
+            )
+            claimed = cursor.fetchone() is not None
+            self._claims_since_cleanup += 1
+            if self._claims_since_cleanup >= 100:
+                self._claims_since_cleanup = 0
+                cursor.execute(
+                    "DELETE FROM webhook_events WHERE seen_at < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'",
+                    [self.ttl]
+                )
+            conn.commit()
+        return claimed
+
+    def claim(self, event_id):
+        "True the first time `event_id` is seen within the TTL; False for a redelivery."
+        if not event_id:
+            return True
+        claimed = self._claim_in_memory(event_id, time.monotonic())
+        if claimed and self.use_postgres:
+            try:
+                claimed = self._claim_in_postgres(event_id)
+            except Exception as e:
+                # Fail open: handling twice beats dropping a check-in.
+                print(f"webhook dedup store unavailable: {e}")
+        self.stats["claimed" if claimed else "duplicates"] += 1
+        return claimed
+
+    def release(self, event_id):
+        "Forget a claim whose handler failed, so LINE's redelivery is handled again."
+        if not event_id:
+            return
+        with self._lock:
+            self._seen.pop(event_id, None)
+        if self.use_postgres:
+            try:
+                self._release_in_postgres(event_id)
+            except Exception as e:
+                print(f"webhook dedup store unavailable: {e}")
+        self.stats["released"] += 1
+
+    def _release_in_postgres(self, event_id):
+        from api.db import get_pool
+
+        pool = self.pool or get_pool()
+        with pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("DELETE FROM webhook_events WHERE event_id = %s", [event_id])
+            conn.commit()
+
+
+deduplicator = WebhookDeduplicator(
+    ttl=int(os.getenv("WEBHOOK_DEDUP_TTL", "3600")),
+    use_postgres=os.getenv("WEBHOOK_DEDUP_STORE") == "postgres",
+)
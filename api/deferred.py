@@ -0,0 +1,79 @@
+import time
+import queue
+import atexit
+import threading
+
+
+class DeferredQueue:
+    """
+    Bounded in-process queue for work that can happen after we've replied to
+    LINE (e.g. Google Sheets writes). A single daemon worker runs jobs in
+    order. Serverless instances may be frozen as soon as a request returns,
+    so callers should `drain()` at the end of each request as well as on exit.
+    """
+    def __init__(self, max_size=100):
+        self._queue = queue.Queue(maxsize=max_size)
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="deferred-worker", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._execute(job)
+            finally:
+                self._queue.task_done()
+
+    def _execute(self, job):
+        fn, args, kwargs, on_error = job
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            print(f"Deferred job {getattr(fn, '__name__', fn)} failed: {e}")
+            if on_error is not None:
+                try:
+                    on_error(e)
+                except Exception as err:
+                    print(f"Deferred error handler failed: {err}")
+
+    def submit(self, fn, *args, on_error=None, **kwargs):
+        """
+        Queue `fn(*args, **kwargs)`. When the queue is full the job runs
+        inline instead so no work is dropped. Returns True if it was queued.
+        """
+        job = (fn, args, kwargs, on_error)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            self._execute(job)
+            return False
+        self._ensure_worker()
+        return True
+
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def drain(self, timeout=None):
+        "Block until queued jobs finish or `timeout` seconds pass. Returns True when empty."
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # Queue.join() can't time out, so wait on the condition it uses.
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                if deadline is None:
+                    self._queue.all_tasks_done.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+
+deferred = DeferredQueue()
+atexit.register(deferred.drain, 10)
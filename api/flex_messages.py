@@ -1,27 +1,81 @@
+import os
+import threading
+from collections import OrderedDict
+
 from linebot.models import FlexSendMessage, BubbleContainer, \
-    BoxComponent, TextComponent, ButtonComponent, PostbackAction
+    BoxComponent, TextComponent, ButtonComponent, PostbackAction, URIAction
+from linebot.models.send_messages import SendMessage
+
+from api.postback import encode_postback, toggle_event
+
+
+class CachedFlexMessage(SendMessage):
+    "Flex message backed by an already-serialized bubble dict, so sending skips the SDK model graph."
+    def __init__(self, alt_text, contents_json, **kwargs):
+        super(CachedFlexMessage, self).__init__(**kwargs)
+        self.type = 'flex'
+        self.alt_text = alt_text
+        self.contents_json = contents_json
+
+    def as_json_dict(self):
+        return {'type': 'flex', 'altText': self.alt_text, 'contents': self.contents_json}
+
+
+_counter_cache = OrderedDict()
+_counter_cache_lock = threading.Lock()
+COUNTER_CACHE_SIZE = int(os.getenv("FLEX_CACHE_SIZE", "2048"))
+counter_cache_stats = {"hits": 0, "misses": 0}
+
+
+def _counter_cache_key(event_name, event_data, state, related_names, selected_related, self_name):
+    return (
+        event_name,
+        tuple(tuple(box.items()) for box in event_data),
+        state,
+        None if related_names is None else tuple(related_names),
+        tuple(selected_related or ()),
+        self_name,
+    )
+
 
 def create_all_counter_message(event_name, event_data, state, related_names=None, selected_related=None, self_name=None):
+    key = _counter_cache_key(event_name, event_data, state, related_names, selected_related, self_name)
+    with _counter_cache_lock:
+        contents_json = _counter_cache.get(key)
+        if contents_json is not None:
+            _counter_cache.move_to_end(key)
+            counter_cache_stats["hits"] += 1
+            return CachedFlexMessage(event_name, contents_json)
+    counter_cache_stats["misses"] += 1
+    bubble = _build_counter_bubble(event_name, event_data, state, related_names, selected_related, self_name)
+    contents_json = bubble.as_json_dict()
+    with _counter_cache_lock:
+        _counter_cache[key] = contents_json
+        while len(_counter_cache) > COUNTER_CACHE_SIZE:
+            _counter_cache.popitem(last=False)
+    return CachedFlexMessage(event_name, contents_json)
+
+
+def _build_counter_bubble(event_name, event_data, state, related_names=None, selected_related=None, self_name=None):
     all_contents = [TextComponent(text=event_name, weight='bold', size='lg')]
     selected_related = selected_related or []
-    rels_str = ",".join(selected_related) if selected_related else ""
+    participants = []
+    if self_name:
+        participants.append(self_name)
+    if related_names:
+        participants.extend(related_names)
 
     for box in event_data:
         contents = []
         for event_id, event in box.items():
-            if event_id in state:
-                # Already selected - clicking will deselect (remove from state)
-                style = 'primary'
-                new_state = state.replace(event_id, '')
-            else:
-                # Not selected - clicking will select (add to state)
-                style = 'secondary'
-                new_state = state + event_id
+            # Clicking toggles this event in the state
+            style = 'primary' if event_id in state else 'secondary'
+            new_state = toggle_event(state, event_id)
             contents.append(
                 ButtonComponent(
                     action=PostbackAction(
                         label=f'{event}',
-                        data=f'action:n&state:{new_state}&rels:{rels_str}',
+                        data=encode_postback('n', new_state, participants, selected_related),
                         display_text=f'{event}',
                         flex=len(event),
                         margin='xs',
@@ -43,11 +97,6 @@ def create_all_counter_message(event_name, event_data, state, related_names=None
         )
     # Related members quick actions (toggle selection)
     if related_names is not None or self_name is not None:
-        participants = []
-        if self_name:
-            participants.append(self_name)
-        if related_names:
-            participants.extend(related_names)
         rel_buttons = []
         for name in participants:
             is_selected = name in selected_related
@@ -55,7 +104,7 @@ def create_all_counter_message(event_name, event_data, state, related_names=None
                 ButtonComponent(
                     action=PostbackAction(
                         label=name,
-                        data=f'action:s&state:{state}&rels:{rels_str}&target:{name}',
+                        data=encode_postback('s', state, participants, selected_related, target=name),
                         display_text=f'選擇 {name}'
                     ),
                     style='primary' if is_selected else 'secondary',
@@ -77,7 +126,7 @@ def create_all_counter_message(event_name, event_data, state, related_names=None
         ButtonComponent(
             action=PostbackAction(
                 label='確認送出',
-                data=f'action:r&state:{state}&rels:{rels_str}',
+                data=encode_postback('r', state, participants, selected_related),
                 display_text='送出紀錄',
                 size='lg',
                 margin='xs',
@@ -92,7 +141,7 @@ def create_all_counter_message(event_name, event_data, state, related_names=None
         ButtonComponent(
             action=PostbackAction(
                 label='重新開始',
-                data='action:n&state:&rels:',
+                data=encode_postback('n', ''),
                 display_text='重新開始',
                 size='lg',
                 margin='xs',
@@ -112,10 +161,7 @@ def create_all_counter_message(event_name, event_data, state, related_names=None
             contents=all_contents
         )
     )
-    flex_message = FlexSendMessage(
-        alt_text=event_name, contents=bubble
-    )
-    return flex_message
+    return bubble
 
 def create_event_flex_message(event, event_id):
     bubble = BubbleContainer(
@@ -149,4 +195,38 @@ def create_event_flex_message(event, event_id):
     flex_message = FlexSendMessage(
         alt_text='恩典點名', contents=bubble
     )
-    return flex_message
\ No newline at end of file
+    return flex_message
+
+
+def create_plan_summary_message(rows):
+    """
+    One card summarising a multi-line 規劃 message. `rows` is a list of
+    {'title', 'when', 'link'} for created events or {'line', 'error'} for
+    lines that failed.
+    """
+    created = [r for r in rows if not r.get('error')]
+    contents = [TextComponent(text=f'已建立 {len(created)}/{len(rows)} 個活動', weight='bold', size='lg')]
+    for row in rows:
+        if row.get('error'):
+            contents.append(
+                TextComponent(text=f"✗ {row['line']}：{row['error']}", size='sm', color='#CC0000', wrap=True)
+            )
+            continue
+        contents.append(
+            TextComponent(
+                text=f"✓ {row['when']} {row['title']}",
+                size='sm',
+                wrap=True,
+                action=URIAction(label='查看行事曆', uri=row['link']) if row.get('link') else None,
+            )
+        )
+    bubble = BubbleContainer(
+        direction='ltr',
+        body=BoxComponent(
+            layout='vertical',
+            spacing='md',
+            contents=contents
+        )
+    )
+    return FlexSendMessage(alt_text=f'已建立 {len(created)} 個活動', contents=bubble)
+
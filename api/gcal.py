@@ -1,11 +1,19 @@
 import os
 import re
 import json
+import time
+import uuid
+import base64
+import bisect
+import hashlib
+import threading
 import datetime as dt
-from typing import Optional, Tuple, Dict, Any
+from itertools import islice
+from typing import Optional, Tuple, Dict, Any, List, Iterator
 
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
+from api.deferred import deferred
+from api.resilience import calendar_guard, is_conflict
+from api.transport import authorized_http
 
 try:
     from zoneinfo import ZoneInfo  # Python 3.9+
@@ -25,17 +33,46 @@ def _get_timezone(timezone_str: str) -> Optional[Any]:
         return None
 
 
+def _load_calendar_discovery_doc() -> Optional[str]:
+    """
+    Return the Calendar v3 discovery document without touching the network:
+    CALENDAR_DISCOVERY_DOC if it points at a file, otherwise the copy bundled
+    with (and pinned by) the installed google-api-python-client.
+    """
+    path = os.getenv("CALENDAR_DISCOVERY_DOC")
+    if path and os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    try:
+        from googleapiclient.discovery_cache import get_static_doc
+    except ImportError:
+        return None
+    return get_static_doc("calendar", "v3")
+
+
 def _build_calendar_service():
+    # Imported here so requests that never touch the calendar don't pay for
+    # loading googleapiclient on a cold start.
+    from google.oauth2.service_account import Credentials
+    from googleapiclient.discovery import build, build_from_document
+
     cred_json_str = os.getenv("SERVICE_ACC_SECRET")
     if not cred_json_str:
         raise RuntimeError("SERVICE_ACC_SECRET is not set in environment.")
     cred_json = json.loads(cred_json_str)
     creds = Credentials.from_service_account_info(cred_json, scopes=CALENDAR_SCOPES)
-    service = build("calendar", "v3", credentials=creds, cache_discovery=False)
+    global _calendar_credentials
+    _calendar_credentials = creds
+    discovery_doc = _load_calendar_discovery_doc()
+    if discovery_doc is not None:
+        return build_from_document(discovery_doc, credentials=creds)
+    print("Calendar discovery document not found locally, fetching it")
+    service = build("calendar", "v3", credentials=creds, cache_discovery=False, static_discovery=False)
     return service
 
 
 _calendar_service = None
+_calendar_credentials = None
 
 
 def get_calendar_service():
@@ -45,49 +82,80 @@ def get_calendar_service():
     return _calendar_service
 
 
-def _extract_date(text: str, now: Optional[dt.datetime]) -> Tuple[Optional[dt.date], Optional[Tuple[int, int, Optional[str]]]]:
-    if now is None:
-        now = dt.datetime.now()
+def _execute(request):
+    "Execute a Calendar API request through the quota guard on this thread's pooled connection."
+    return calendar_guard.call(request.execute, http=authorized_http(_calendar_credentials))
 
-    m = re.search(r"(\d{4})[\-/](\d{1,2})[\-/](\d{1,2})", text)
-    if m:
-        year, month, day = map(int, m.groups())
-        date_obj = dt.date(year, month, day)
-        return date_obj, _extract_time(text)
 
-    m = re.search(r"(\d{1,2})[\-/](\d{1,2})(?!\d)", text)
-    if m:
-        month, day = map(int, m.groups())
-        year = now.year
-        date_obj = dt.date(year, month, day)
-        return date_obj, _extract_time(text)
+# Precompiled date/time patterns. Each form is searched on the original text
+# and the title is stripped form by form in this order, exactly like the
+# original parser: one alternation can't be used because forms overlap
+# (e.g. "7點 9/10" would let 點 claim the month digit).
+_YMD_RE = re.compile(r"(\d{4})[\-/](\d{1,2})[\-/](\d{1,2})")
+_MD_RE = re.compile(r"(\d{1,2})[\-/](\d{1,2})(?!\d)")
+_ZH_MD_RE = re.compile(r"(\d{1,2})\s*月\s*(\d{1,2})\s*日")
+_HM_RE = re.compile(r"(上午|下午|AM|PM)?\s*(\d{1,2})[:：](\d{2})", re.IGNORECASE)
+_ZH_HM_RE = re.compile(r"(上午|下午)?\s*(\d{1,2})\s*(?:點|時)\s*(?:(\d{1,2})\s*分?)?")
+_RANGE_RE = re.compile(r"\b(\d{1,2})(\d{2})\s*[-~–—]\s*(\d{1,2})(\d{2})\b")
+_WHITESPACE_RE = re.compile(r"\s+")
 
-    m = re.search(r"(\d{1,2})\s*月\s*(\d{1,2})\s*日", text)
-    if m:
-        month, day = map(int, m.groups())
-        year = now.year
-        date_obj = dt.date(year, month, day)
-        return date_obj, _extract_time(text)
+# Each pattern needs one of these characters to match. Stripping only ever
+# inserts spaces, so a pattern whose characters aren't in the original text
+# can be skipped without changing the result.
+_DATE_SEP = frozenset("-/")
+_ZH_MD_CHARS = frozenset("月")
+_HM_CHARS = frozenset(":：")
+_ZH_HM_CHARS = frozenset("點時")
+_RANGE_CHARS = frozenset("-~–—")
 
-    return None, None
+# Date forms in order of preference, and every token in title-stripping order.
+_DATE_PATTERNS = ((_YMD_RE, _DATE_SEP), (_MD_RE, _DATE_SEP), (_ZH_MD_RE, _ZH_MD_CHARS))
+_TITLE_STRIP_PATTERNS = _DATE_PATTERNS + ((_HM_RE, _HM_CHARS), (_ZH_HM_RE, _ZH_HM_CHARS), (_RANGE_RE, _RANGE_CHARS))
 
 
-def _extract_time(text: str) -> Optional[Tuple[int, int, Optional[str]]]:
-    m = re.search(r"(上午|下午|AM|PM)?\s*(\d{1,2})[:：](\d{2})", text, re.IGNORECASE)
-    if m:
-        ampm = m.group(1)
-        hour = int(m.group(2))
-        minute = int(m.group(3))
-        return hour, minute, ampm
+def tokenize_event_text(text: str) -> Dict[str, Any]:
+    """
+    Find the first match of each date/time form in `text` and return
+    {"date": (year or None, month, day), "time": (hour, minute, ampm),
+     "time_range": (sh, sm, eh, em), "title": str}. Missing parts are None;
+    `title` is the text with every token removed and whitespace collapsed.
+    """
+    chars = frozenset(text)
+    date = None
+    for pattern, needs in _DATE_PATTERNS:
+        m = pattern.search(text) if not chars.isdisjoint(needs) else None
+        if m is not None:
+            if pattern is _YMD_RE:
+                date = tuple(map(int, m.groups()))
+            else:
+                date = (None, int(m.group(1)), int(m.group(2)))
+            break
+    if date is None:
+        # No date means no event; skip the rest of the scan.
+        return {"date": None, "time": None, "time_range": None, "title": ""}
+
+    time_tuple = None
+    m = _HM_RE.search(text) if not chars.isdisjoint(_HM_CHARS) else None
+    if m is not None:
+        time_tuple = (int(m.group(2)), int(m.group(3)), m.group(1))
+    else:
+        m = _ZH_HM_RE.search(text) if not chars.isdisjoint(_ZH_HM_CHARS) else None
+        if m is not None:
+            time_tuple = (int(m.group(2)), int(m.group(3)) if m.group(3) else 0, m.group(1))
 
-    m = re.search(r"(上午|下午)?\s*(\d{1,2})\s*(?:點|時)\s*(?:(\d{1,2})\s*分?)?", text)
-    if m:
-        ampm = m.group(1)
-        hour = int(m.group(2))
-        minute = int(m.group(3)) if m.group(3) else 0
-        return hour, minute, ampm
+    time_range = None
+    m = _RANGE_RE.search(text) if not chars.isdisjoint(_RANGE_CHARS) else None
+    if m is not None:
+        sh, sm, eh, em = map(int, m.groups())
+        # Validate hour/minute bounds
+        if 0 <= sh <= 23 and 0 <= eh <= 23 and 0 <= sm <= 59 and 0 <= em <= 59:
+            time_range = (sh, sm, eh, em)
 
-    return None
+    for pattern, needs in _TITLE_STRIP_PATTERNS:
+        if not chars.isdisjoint(needs):
+            text = pattern.sub(" ", text)
+    title = _WHITESPACE_RE.sub(" ", text).strip()
+    return {"date": date, "time": time_tuple, "time_range": time_range, "title": title}
 
 
 def _apply_ampm(hour: int, ampm: Optional[str]) -> int:
@@ -108,21 +176,15 @@ def parse_event_text(text: str, timezone_str: str = "Asia/Taipei", now: Optional
     if now is None:
         now = dt.datetime.now()
 
-    date_obj, time_tuple = _extract_date(text, now)
-    if not date_obj:
+    tokens = tokenize_event_text(text)
+    if not tokens["date"]:
         return None
+    year, month, day = tokens["date"]
+    date_obj = dt.date(year if year is not None else now.year, month, day)
+    time_tuple = tokens["time"]
+    time_range = tokens["time_range"]
 
-    # Extract time range like 900 - 1300 (HHMM-HHMM) if present
-    time_range = _extract_time_range(text)
-
-    text_clean = re.sub(r"(\d{4})[\-/](\d{1,2})[\-/](\d{1,2})", " ", text)
-    text_clean = re.sub(r"(\d{1,2})[\-/](\d{1,2})(?!\d)", " ", text_clean)
-    text_clean = re.sub(r"(\d{1,2})\s*月\s*(\d{1,2})\s*日", " ", text_clean)
-    text_clean = re.sub(r"(上午|下午|AM|PM)?\s*(\d{1,2})[:：](\d{2})", " ", text_clean, flags=re.IGNORECASE)
-    text_clean = re.sub(r"(上午|下午)?\s*(\d{1,2})\s*(?:點|時)\s*(?:(\d{1,2})\s*分?)?", " ", text_clean)
-    # Remove HHMM - HHMM time range from title text
-    text_clean = re.sub(r"\b(\d{1,2})(\d{2})\s*[-~–—]\s*(\d{1,2})(\d{2})\b", " ", text_clean)
-    title = re.sub(r"\s+", " ", text_clean).strip()
+    title = tokens["title"]
     if not title:
         title = "未命名活動"
 
@@ -169,22 +231,8 @@ def parse_event_text(text: str, timezone_str: str = "Asia/Taipei", now: Optional
         }
 
 
-def _extract_time_range(text: str) -> Optional[Tuple[int, int, int, int]]:
-    """
-    Extract a time range like '900 - 1300' or '0900-1300'. Returns (start_hour, start_min, end_hour, end_min).
-    """
-    m = re.search(r"\b(\d{1,2})(\d{2})\s*[-~–—]\s*(\d{1,2})(\d{2})\b", text)
-    if not m:
-        return None
-    sh, sm, eh, em = map(int, m.groups())
-    # Validate hour/minute bounds
-    if not (0 <= sh <= 23 and 0 <= eh <= 23 and 0 <= sm <= 59 and 0 <= em <= 59):
-        return None
-    return sh, sm, eh, em
-
-def create_calendar_event(
+def _event_body(
     summary: str,
-    calendar_id: Optional[str] = None,
     start_dt: Optional[dt.datetime] = None,
     end_dt: Optional[dt.datetime] = None,
     date: Optional[dt.date] = None,
@@ -192,19 +240,6 @@ def create_calendar_event(
     description: Optional[str] = None,
     location: Optional[str] = None,
 ) -> Dict[str, Any]:
-    """
-    Create a Google Calendar event. Returns the created event resource dict.
-    If date is provided, creates an all-day event. Otherwise uses start_dt/end_dt.
-
-    calendar_id example: 'example.com_aaaaaaaaaaaaaaaaaaaaaaaaaa@group.calendar.google.com'
-    If not provided, falls back to env GOOGLE_CALENDAR_ID, then an example ID.
-    """
-    if calendar_id is None:
-        calendar_id = os.getenv(
-            "GOOGLE_CALENDAR_ID",
-            "example.com_aaaaaaaaaaaaaaaaaaaaaaaaaa@group.calendar.google.com",
-        )
-
     body: Dict[str, Any] = {
         "summary": summary,
     }
@@ -221,49 +256,358 @@ def create_calendar_event(
             raise ValueError("start_dt and end_dt must be provided for timed events")
         body["start"] = {"dateTime": start_dt.isoformat(), "timeZone": timezone_str}
         body["end"] = {"dateTime": end_dt.isoformat(), "timeZone": timezone_str}
+    return body
+
+
+def _event_id(key: str) -> str:
+    """
+    Client-chosen event id derived from `key`, in the base32hex alphabet
+    (a-v, 0-9) Calendar requires. A retried insert then conflicts with the
+    event its first attempt created instead of adding a duplicate.
+    """
+    digest = hashlib.sha256(key.encode("utf-8")).digest()[:20]
+    return base64.b32hexencode(digest).decode("ascii").lower()
+
+
+def _insert_event(service, calendar_id: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        return _execute(service.events().insert(calendarId=calendar_id, body=body))
+    except Exception as e:
+        if not is_conflict(e):
+            raise
+    # An earlier attempt (or delivery) already created it.
+    return _execute(service.events().get(calendarId=calendar_id, eventId=body["id"]))
+
+
+def create_calendar_event(
+    summary: str,
+    calendar_id: Optional[str] = None,
+    start_dt: Optional[dt.datetime] = None,
+    end_dt: Optional[dt.datetime] = None,
+    date: Optional[dt.date] = None,
+    timezone_str: str = "Asia/Taipei",
+    description: Optional[str] = None,
+    location: Optional[str] = None,
+    event_key: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Create a Google Calendar event. Returns the created event resource dict.
+    If date is provided, creates an all-day event. Otherwise uses start_dt/end_dt.
+
+    calendar_id example: 'example.com_aaaaaaaaaaaaaaaaaaaaaaaaaa@group.calendar.google.com'
+    If not provided, falls back to env GOOGLE_CALENDAR_ID, then an example ID.
+
+    The event id is derived from `event_key` (e.g. the webhook event id), so
+    retrying the same request returns the existing event.
+    """
+    if calendar_id is None:
+        calendar_id = _default_calendar_id()
+
+    body = _event_body(summary, start_dt, end_dt, date, timezone_str, description, location)
+    body["id"] = _event_id(f"{calendar_id}:{event_key or uuid.uuid4().hex}")
 
     service = get_calendar_service()
-    event = service.events().insert(calendarId=calendar_id, body=body).execute()
+    event = _insert_event(service, calendar_id, body)
+    store = _event_stores.get(calendar_id)
+    if store is not None:
+        store.apply(event)
     return event
 
 
-def list_events_next_days(days: int = 30, calendar_id: Optional[str] = None, timezone_str: str = "Asia/Taipei"):
+# Google rejects batch requests with more than 50 calls.
+CALENDAR_BATCH_LIMIT = 50
+
+
+def create_calendar_events(
+    events: List[Dict[str, Any]],
+    calendar_id: Optional[str] = None,
+    timezone_str: str = "Asia/Taipei",
+    event_key: Optional[str] = None,
+) -> List[Tuple[Optional[Dict[str, Any]], Optional[Exception]]]:
     """
-    Return events in the next `days` days as a list of dicts: {start, end, summary, is_all_day}.
+    Insert several events with one batch HTTP request. `events` are
+    `parse_event_text` results; returns (created event, error) per input,
+    in order, with exactly one of the two set. Ids come from `event_key`
+    and the position, so a retried batch doesn't duplicate what went in.
     """
     if calendar_id is None:
-        calendar_id = os.getenv(
-            "GOOGLE_CALENDAR_ID",
-            "example.com_aaaaaaaaaaaaaaaaaaaaaaaaaa@group.calendar.google.com",
+        calendar_id = _default_calendar_id()
+    if len(events) > CALENDAR_BATCH_LIMIT:
+        raise ValueError(f"At most {CALENDAR_BATCH_LIMIT} events per batch")
+
+    results: List[Tuple[Optional[Dict[str, Any]], Optional[Exception]]] = [(None, None)] * len(events)
+
+    def on_response(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    key = event_key or uuid.uuid4().hex
+    bodies = []
+    for i, parsed in enumerate(events):
+        body = _event_body(
+            parsed["title"], parsed["start_dt"], parsed["end_dt"], parsed["date"], timezone_str,
         )
+        body["id"] = _event_id(f"{calendar_id}:{key}:{i}")
+        bodies.append(body)
+
+    service = get_calendar_service()
+    batch = service.new_batch_http_request(callback=on_response)
+    for i, body in enumerate(bodies):
+        batch.add(service.events().insert(calendarId=calendar_id, body=body), request_id=str(i))
+    _execute(batch)
+    for i, (_, error) in enumerate(results):
+        if error is not None and is_conflict(error):
+            try:
+                results[i] = (_execute(service.events().get(calendarId=calendar_id, eventId=bodies[i]["id"])), None)
+            except Exception as e:
+                results[i] = (None, e)
+
+    store = _event_stores.get(calendar_id)
+    if store is not None:
+        for created, _ in results:
+            if created is not None:
+                store.apply(created)
+    return results
+
+
+# Partial response: only the fields we read, instead of full event resources.
+EVENT_LIST_FIELDS = "items(id,status,summary,start,end),nextPageToken,nextSyncToken"
+
+
+def list_events_next_days(
+    days: int = 30,
+    calendar_id: Optional[str] = None,
+    timezone_str: str = "Asia/Taipei",
+    page_size: int = 50,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Yield events in the next `days` days as dicts: {start, end, summary, is_all_day}.
+    Pages are fetched lazily, so a caller that stops early (e.g. via
+    itertools.islice) never requests the remaining pages.
+    """
+    if calendar_id is None:
+        calendar_id = _default_calendar_id()
 
     now = dt.datetime.now(dt.timezone.utc)
     end = now + dt.timedelta(days=days)
 
     service = get_calendar_service()
-    events_result = service.events().list(
-        calendarId=calendar_id,
-        timeMin=now.isoformat(),
-        timeMax=end.isoformat(),
-        singleEvents=True,
-        orderBy="startTime",
-    ).execute()
-
-    items = events_result.get("items", [])
-    results = []
-    for e in items:
-        start = e.get("start", {})
-        endt = e.get("end", {})
-        summary = e.get("summary", "(無標題)")
-        is_all_day = "date" in start
-        start_str = start.get("dateTime") or start.get("date")
-        end_str = endt.get("dateTime") or endt.get("date")
-        results.append({
-            "summary": summary,
-            "start": start_str,
-            "end": end_str,
-            "is_all_day": is_all_day,
-        })
-    return results
+    page_token = None
+    while True:
+        events_result = _execute(service.events().list(
+            calendarId=calendar_id,
+            timeMin=now.isoformat(),
+            timeMax=end.isoformat(),
+            singleEvents=True,
+            orderBy="startTime",
+            maxResults=page_size,
+            pageToken=page_token,
+            fields="items(summary,start,end),nextPageToken",
+        ))
+        for e in events_result.get("items", []):
+            yield _summarize_event(e)
+        page_token = events_result.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def _default_calendar_id() -> str:
+    return os.getenv(
+        "GOOGLE_CALENDAR_ID",
+        "example.com_aaaaaaaaaaaaaaaaaaaaaaaaaa@group.calendar.google.com",
+    )
+
+
+def _summarize_event(e: Dict[str, Any]) -> Dict[str, Any]:
+    start = e.get("start", {})
+    endt = e.get("end", {})
+    return {
+        "summary": e.get("summary", "(無標題)"),
+        "start": start.get("dateTime") or start.get("date"),
+        "end": endt.get("dateTime") or endt.get("date"),
+        "is_all_day": "date" in start,
+    }
+
 
+class EventStore:
+    """
+    Local copy of one calendar, kept fresh with Calendar incremental sync.
+
+    The first refresh pages through the calendar from `history_days` ago
+    onwards and keeps the `nextSyncToken`; later refreshes only fetch changes
+    since that token. That first sync is slow, so `warm_in_background` runs
+    it on the deferred queue while callers answer from a bounded API query.
+    Events are indexed by start time so range queries are a bisect plus a
+    short scan. Data older than `max_staleness` seconds triggers a refresh.
+    """
 
+    def __init__(self, calendar_id: str, timezone_str: str = "Asia/Taipei", max_staleness: float = 300, history_days: int = 1):
+        self.calendar_id = calendar_id
+        self.tzinfo = _get_timezone(timezone_str) or dt.timezone.utc
+        self.max_staleness = max_staleness
+        self.history_days = history_days
+        self._warming = False
+        self._events: Dict[str, Tuple[dt.datetime, dt.datetime, Dict[str, Any]]] = {}
+        self._index: List[Tuple[dt.datetime, str]] = []
+        self._max_duration = dt.timedelta(0)
+        self._sync_token: Optional[str] = None
+        self._synced_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def _to_datetime(self, when: Dict[str, Any]) -> Optional[dt.datetime]:
+        if "dateTime" in when:
+            return dt.datetime.fromisoformat(when["dateTime"].replace("Z", "+00:00"))
+        if "date" in when:
+            d = dt.date.fromisoformat(when["date"])
+            return dt.datetime(d.year, d.month, d.day, tzinfo=self.tzinfo)
+        return None
+
+    def _remove(self, event_id: str) -> None:
+        old = self._events.pop(event_id, None)
+        if old is not None:
+            i = bisect.bisect_left(self._index, (old[0], event_id))
+            if i < len(self._index) and self._index[i] == (old[0], event_id):
+                del self._index[i]
+
+    def _apply(self, e: Dict[str, Any]) -> None:
+        event_id = e.get("id")
+        if not event_id:
+            return
+        self._remove(event_id)
+        if e.get("status") == "cancelled":
+            return
+        start = self._to_datetime(e.get("start", {}))
+        end = self._to_datetime(e.get("end", {})) or start
+        if start is None:
+            return
+        self._events[event_id] = (start, end, _summarize_event(e))
+        bisect.insort(self._index, (start, event_id))
+        self._max_duration = max(self._max_duration, end - start)
+
+    def apply(self, e: Dict[str, Any]) -> None:
+        "Apply a single event resource (e.g. one we just inserted) without a sync."
+        with self._lock:
+            self._apply(e)
+
+    def _fetch(self, **params) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        service = get_calendar_service()
+        items: List[Dict[str, Any]] = []
+        page_token = None
+        while True:
+            resp = _execute(service.events().list(
+                calendarId=self.calendar_id,
+                singleEvents=True,
+                pageToken=page_token,
+                fields=EVENT_LIST_FIELDS,
+                **params,
+            ))
+            items.extend(resp.get("items", []))
+            page_token = resp.get("nextPageToken")
+            if not page_token:
+                return items, resp.get("nextSyncToken")
+
+    def full_sync(self) -> None:
+        # Only upcoming events are ever queried, so skip the calendar's history.
+        time_min = dt.datetime.now(dt.timezone.utc) - dt.timedelta(days=self.history_days)
+        items, token = self._fetch(timeMin=time_min.isoformat())
+        self._events.clear()
+        self._index = []
+        self._max_duration = dt.timedelta(0)
+        for e in items:
+            self._apply(e)
+        self._sync_token = token
+
+    def sync(self) -> None:
+        from googleapiclient.errors import HttpError
+
+        with self._lock:
+            if self._sync_token is None:
+                self.full_sync()
+            else:
+                try:
+                    items, token = self._fetch(syncToken=self._sync_token)
+                except HttpError as e:
+                    # 410 Gone: the sync token expired, start over.
+                    if getattr(e, "resp", None) is None or e.resp.status != 410:
+                        raise
+                    self.full_sync()
+                else:
+                    for item in items:
+                        self._apply(item)
+                    self._sync_token = token or self._sync_token
+            self._synced_at = time.monotonic()
+
+    def invalidate(self) -> None:
+        "Force the next query to run an incremental sync first."
+        self._synced_at = None
+
+    def is_warm(self) -> bool:
+        "True once a full sync has completed."
+        return self._sync_token is not None
+
+    def warm_in_background(self) -> None:
+        "Queue the first full sync unless one is already queued."
+        with self._lock:
+            if self._warming or self.is_warm():
+                return
+            self._warming = True
+
+        def warm():
+            try:
+                self.sync()
+            finally:
+                self._warming = False
+
+        deferred.submit(warm)
+
+    def is_stale(self) -> bool:
+        return self._synced_at is None or time.monotonic() - self._synced_at > self.max_staleness
+
+    def query(self, time_min: dt.datetime, time_max: dt.datetime) -> List[Dict[str, Any]]:
+        "Events overlapping [time_min, time_max), ordered by start time."
+        if self.is_stale():
+            self.sync()
+        with self._lock:
+            lo = bisect.bisect_left(self._index, (time_min - self._max_duration, ""))
+            hi = bisect.bisect_left(self._index, (time_max, ""))
+            results = []
+            for start, event_id in self._index[lo:hi]:
+                _, end, summary = self._events[event_id]
+                if end > time_min:
+                    results.append(summary)
+            return results
+
+
+_event_stores: Dict[str, EventStore] = {}
+_event_stores_lock = threading.Lock()
+
+
+def get_event_store(calendar_id: Optional[str] = None) -> EventStore:
+    if calendar_id is None:
+        calendar_id = _default_calendar_id()
+    with _event_stores_lock:
+        store = _event_stores.get(calendar_id)
+        if store is None:
+            store = EventStore(
+                calendar_id,
+                max_staleness=float(os.getenv("CALENDAR_MAX_STALENESS", "300")),
+            )
+            _event_stores[calendar_id] = store
+    return store
+
+
+def list_upcoming_events(days: int = 30, calendar_id: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Same result shape as `list_events_next_days`, answered from the local
+    event store, or streamed straight from the API when CALENDAR_USE_STORE=0
+    or while the store's first sync is still pending. At most `limit` events
+    are returned.
+    """
+    if os.getenv("CALENDAR_USE_STORE", "1") == "0":
+        return list(islice(list_events_next_days(days, calendar_id), limit))
+    store = get_event_store(calendar_id)
+    if not store.is_warm():
+        store.warm_in_background()
+        return list(islice(list_events_next_days(days, calendar_id), limit))
+    now = dt.datetime.now(dt.timezone.utc)
+    events = store.query(now, now + dt.timedelta(days=days))
+    return events[:limit] if limit is not None else events
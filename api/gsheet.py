@@ -1,40 +1,41 @@
 import os
 import json
-import gspread
-from google.oauth2.service_account import Credentials
+import time
+import threading
+from array import array
+from contextlib import nullcontext
 
-from flask import current_app
+from flask import current_app, has_app_context
+
+from api.deferred import deferred
+from api.postback import EVENT_COLUMNS, state_to_mask, mask_to_state
+from api.resilience import sheets_guard
+from api.transport import authorized_session
 
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-cred_json = json.loads(os.getenv("SERVICE_ACC_SECRET"))
-creds = Credentials.from_service_account_info(cred_json, scopes=scope)
-client = gspread.authorize(creds)
-
-NAME_MAP = {
-    "daniel": "2",
-    "柯建伸": "3",
-    "David Lee": "4",
-    "曾木宣": "5",
-    "楊光宇": "6",
-    "李成新": "7",
-    "王志均": "8",
-    "施明隴": "10",
-    "李其翰": "11",
-    "Grace Lee": "26",
-    "張筱翊": "27",
-    "柯星臨": "28",
-    "Zera 😊": "29",
-    "周佳韻": "30",
-    "余其樺": "31",
-    "蔡紋綺": "32",
-    "楊歆悅": "33",
-    "楊依璨": "104",
-    "林佳瑩": "34",
-    "何繡富": "35",
-    "朱珮瑜": "36",
-    "秦孝芬": "39",
-    "魏廷妤𝔚𝔢𝔦🌮": "40"
-}
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    "Authorize gspread on first use so cold starts that don't write the sheet skip it."
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import gspread
+                from google.oauth2.service_account import Credentials
+
+                cred_json = json.loads(os.getenv("SERVICE_ACC_SECRET"))
+                creds = Credentials.from_service_account_info(cred_json, scopes=scope)
+                _client = gspread.Client(creds, session=authorized_session(creds))
+    return _client
+
+SHEET_KEY = '1wMN8njXEchf9-GedPcsz0eKCvJpYUBxaHPUelBdamKQ'
+SHEET_NAME = 'grace'
+# Column holding each member's display name; its row number is where their check-ins go.
+NAME_COLUMN = int(os.getenv("SHEET_NAME_COLUMN", "1"))
 
 RELATED = {
     "楊光宇": ["楊歆悅", "楊依璨", "蔡紋綺"],
@@ -47,43 +48,372 @@ def get_related_names_for(user_name):
     return RELATED.get(user_name, [])
 
 
-def update_gsheet_checkbox(name, event, attend):
-    sheet_key = '1wMN8njXEchf9-GedPcsz0eKCvJpYUBxaHPUelBdamKQ'
-    sheet_name = 'grace'
+# Spreadsheet/worksheet handles are cached per warm process so a write costs
+# one API call instead of two metadata fetches plus the update.
+_spreadsheet = None
+_worksheet = None
+_worksheet_id = None
+
+
+def get_spreadsheet():
+    global _spreadsheet
+    if _spreadsheet is None:
+        _spreadsheet = get_client().open_by_key(SHEET_KEY)
+    return _spreadsheet
+
+
+def get_worksheet():
+    global _worksheet, _worksheet_id
+    import gspread
+
+    if _worksheet is None:
+        spreadsheet = get_spreadsheet()
+        try:
+            _worksheet = spreadsheet.worksheet(SHEET_NAME)
+        except gspread.exceptions.WorksheetNotFound:
+            # The tab was renamed; follow it by id if we've seen it before.
+            if _worksheet_id is None:
+                raise
+            _worksheet = spreadsheet.get_worksheet_by_id(_worksheet_id)
+        _worksheet_id = _worksheet.id
+    return _worksheet
+
+
+def invalidate_sheet_cache():
+    global _spreadsheet, _worksheet
+    _spreadsheet = None
+    _worksheet = None
+
+
+def _is_stale_sheet_error(e):
+    import gspread
+
+    if isinstance(e, gspread.exceptions.WorksheetNotFound):
+        return True
+    if isinstance(e, gspread.exceptions.APIError):
+        code = getattr(e, 'code', None)
+        if code is None:
+            code = getattr(getattr(e, 'response', None), 'status_code', None)
+        return code == 404 or (code == 400 and 'Unable to parse range' in str(e))
+    return False
+
+
+def _with_sheet(write):
+    """
+    Run `write(worksheet)` through the Sheets quota/retry guard, re-resolving
+    the cached handles once if the tab moved.
+    """
+    try:
+        return sheets_guard.call(lambda: write(get_worksheet()))
+    except Exception as e:
+        if not _is_stale_sheet_error(e):
+            raise
+        current_app.logger.info(f"gsheet handle stale ({e}), reloading metadata")
+        invalidate_sheet_cache()
+        return sheets_guard.call(lambda: write(get_worksheet()))
+
+
+class NameIndex:
+    """
+    name -> row index built from the sheet's name column.
+
+    The column is re-read every `refresh_interval` seconds, but only if the
+    spreadsheet's last-update time changed. An unknown name triggers one
+    re-index; concurrent misses share it and misses within
+    `miss_cooldown` seconds of the last re-index don't start another.
+    """
+    def __init__(self, refresh_interval=600, miss_cooldown=30, name_for_user=None):
+        self.refresh_interval = refresh_interval
+        self.miss_cooldown = miss_cooldown
+        self.name_for_user = name_for_user
+        self._rows = {}
+        self._user_rows = {}
+        self._version = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def _spreadsheet_version(self):
+        try:
+            spreadsheet = sheets_guard.call(get_spreadsheet)
+            get_version = getattr(spreadsheet, 'get_lastUpdateTime', None)
+            return sheets_guard.call(get_version) if get_version else None
+        except Exception:
+            return None
+
+    def _reindex(self, check_version=True):
+        version = self._spreadsheet_version() if check_version else None
+        if version is None or version != self._version or not self._rows:
+            names = _with_sheet(lambda sheet: sheet.col_values(NAME_COLUMN))
+            rows = {}
+            for row, name in enumerate(names, start=1):
+                name = name.strip()
+                if name and name not in rows:
+                    rows[name] = str(row)
+            self._rows = rows
+            self._user_rows = {}
+            self._version = version
+            print(f"Indexed {len(rows)} names from sheet column {NAME_COLUMN}")
+        self._loaded_at = time.monotonic()
+
+    def refresh(self, force=False):
+        with self._lock:
+            self._reindex(check_version=not force)
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_interval:
+            with self._lock:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at > self.refresh_interval:
+                    self._reindex()
+
+    def is_loaded(self):
+        return self._loaded_at is not None
+
+    def row_for(self, name, refresh=True):
+        "With `refresh=False` only the current index is consulted; the sheet is never read."
+        if not refresh:
+            return self._rows.get(name)
+        self._ensure_fresh()
+        row = self._rows.get(name)
+        if row is not None:
+            return row
+        loaded_at = self._loaded_at
+        with self._lock:
+            # Another miss may have re-indexed while we waited for the lock.
+            if self._loaded_at == loaded_at and time.monotonic() - self._loaded_at > self.miss_cooldown:
+                self._reindex(check_version=False)
+        return self._rows.get(name)
+
+    def row_for_user(self, user_id, name=None, refresh=True):
+        """
+        Row for a LINE user_id, cached until the next re-index. `name`, when
+        the caller already knows it, saves the users-table lookup on a miss.
+        """
+        if refresh:
+            self._ensure_fresh()
+        row = self._user_rows.get(user_id)
+        if row is not None:
+            return row
+        if name is None and self.name_for_user is not None:
+            name = self.name_for_user(user_id)
+        row = self.row_for(name, refresh) if name else None
+        if row is not None:
+            self._user_rows[user_id] = row
+        return row
+
+
+def _name_for_user(user_id):
+    from api.db import User
+    return User(user_id, None, None).fetch_name()
+
+
+name_index = NameIndex(
+    refresh_interval=int(os.getenv("NAME_INDEX_TTL", "600")),
+    name_for_user=_name_for_user,
+)
 
-    name_id = NAME_MAP.get(name)
+
+def _row_for(name):
+    name_id = name_index.row_for(name)
+    if not name_id:
+        current_app.logger.info(f'{name} not found in sheet column {NAME_COLUMN}')
+    return name_id
+
+
+class SheetSnapshot:
+    """
+    This week's check-ins for every row, read with one batch_get of C:L and
+    held as one bitmask per row (bit layout from api.postback).
+
+    Lookups never read the sheet: while the snapshot is cold or older than
+    `ttl` seconds they schedule a refresh on the deferred queue instead.
+    States recorded but not yet flushed to the sheet are kept as pending
+    overrides so a refresh that lands before the flush doesn't roll them
+    back; overrides older than `pending_ttl` are dropped in case their flush
+    never happened.
+    """
+    def __init__(self, ttl=300, pending_ttl=600):
+        self.ttl = ttl
+        self.pending_ttl = pending_ttl
+        self._masks = array('H')
+        self._pending = {}  # row -> (mask, recorded_at)
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        with self._lock:
+            self._reload()
+
+    def _reload(self):
+        ranges = _with_sheet(lambda sheet: sheet.batch_get(["C:L"], value_render_option="UNFORMATTED_VALUE"))
+        values = ranges[0] if ranges else []
+        masks = array('H', [0]) * len(values)
+        for i, cells in enumerate(values):
+            mask = 0
+            for bit, cell in enumerate(cells[:len(EVENT_COLUMNS)]):
+                if cell is True or str(cell).upper() == 'TRUE':
+                    mask |= 1 << bit
+            masks[i] = mask
+        now = time.monotonic()
+        self._pending = {row: p for row, p in self._pending.items() if now - p[1] < self.pending_ttl}
+        self._masks = masks
+        self._loaded_at = now
+        print(f"Snapshotted {len(masks)} sheet rows")
+
+    def _ensure_fresh(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            with self._lock:
+                if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+                    self._reload()
+
+    def is_fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at <= self.ttl
+
+    def state_for_row(self, row, allow_stale=False):
+        """
+        State string for a 1-based sheet row ('' for rows past the data), or
+        None while the snapshot is cold, or stale unless `allow_stale`.
+        """
+        if not self.is_fresh():
+            schedule_refresh()
+            if self._loaded_at is None or not allow_stale:
+                return None
+        row = int(row)
+        pending = self._pending.get(row)
+        if pending is not None:
+            return mask_to_state(pending[0])
+        masks = self._masks
+        return mask_to_state(masks[row - 1]) if 0 < row <= len(masks) else ""
+
+    def record(self, row, state, written=False):
+        """
+        Note `state` for `row`: pending until the sheet write lands, or
+        applied directly once `written`.
+        """
+        row, mask = int(row), state_to_mask(state)
+        with self._lock:
+            if written:
+                pending = self._pending.get(row)
+                if pending is not None and pending[0] == mask:
+                    del self._pending[row]
+                if row > len(self._masks):
+                    self._masks.extend([0] * (row - len(self._masks)))
+                self._masks[row - 1] = mask
+            else:
+                self._pending[row] = (mask, time.monotonic())
+
+
+sheet_snapshot = SheetSnapshot(ttl=int(os.getenv("SHEET_SNAPSHOT_TTL", "300")))
+
+
+_refresh_scheduled = False
+_refresh_lock = threading.Lock()
+
+
+def schedule_refresh():
+    "Refresh the name index and snapshot on the deferred queue, once at a time."
+    global _refresh_scheduled
+    with _refresh_lock:
+        if _refresh_scheduled:
+            return
+        _refresh_scheduled = True
+    app = current_app._get_current_object() if has_app_context() else None
+    deferred.submit(_refresh_sheet_caches, app)
+
+
+def _refresh_sheet_caches(app):
+    global _refresh_scheduled
+    try:
+        with app.app_context() if app is not None else nullcontext():
+            name_index._ensure_fresh()
+            sheet_snapshot._ensure_fresh()
+    finally:
+        with _refresh_lock:
+            _refresh_scheduled = False
+
+
+def current_state_for(name, user_id=None, allow_stale=False):
+    """
+    The name's checked events this week per the snapshot, or None if unknown
+    (not in the sheet, or the caches are still warming up). Only reads what
+    is already in memory, so it is safe before a reply. Pass `user_id` when
+    `name` is that LINE user's own name.
+    """
+    if user_id:
+        name_id = name_index.row_for_user(user_id, name, refresh=False)
+    else:
+        name_id = name_index.row_for(name, refresh=False)
+    if not name_id:
+        if not name_index.is_loaded():
+            schedule_refresh()
+        return None
+    return sheet_snapshot.state_for_row(name_id, allow_stale)
+
+
+def record_pending_states(states):
+    "Mark {name: state} as recorded so the snapshot reflects it before the flush."
+    for name, state in states.items():
+        name_id = name_index.row_for(name, refresh=False)
+        if name_id:
+            sheet_snapshot.record(name_id, state)
+
+
+def update_gsheet_checkbox(name, event, attend):
+    name_id = _row_for(name)
     if name_id:
         try:
-            spreadsheet = client.open_by_key(sheet_key)
-            sheet = spreadsheet.worksheet(sheet_name)
-            sheet.update_acell(f"{event}{name_id}", attend)
+            _with_sheet(lambda sheet: sheet.update_acell(f"{event}{name_id}", attend))
             current_app.logger.info(f"gsheet updated at {event}{name_id}, value: {attend}")
         except Exception as e:
             current_app.logger.error(e)
-    else:
-        current_app.logger.info(f'{name} doesnt have name_id, please add to mapping')
 
 
-def update_gsheet_checkbox_batch(name, state):
-    sheet_key = '1wMN8njXEchf9-GedPcsz0eKCvJpYUBxaHPUelBdamKQ'
-    sheet_name = 'grace'
+def _state_to_row(state):
+    return [e in state for e in EVENT_COLUMNS]
+
+
+def update_gsheet_checkboxes(states):
+    """
+    Write several people's C:L rows in a single values.batchUpdate request.
+    `states` is {name: state}; returns {name: bool} telling whether each
+    person's row was written.
+    """
+    results = {}
+    rows = []
+    for name, state in states.items():
+        name_id = _row_for(name)
+        if not name_id:
+            results[name] = False
+            continue
+        rows.append((name_id, state))
+        results[name] = True
+    if not rows:
+        return results
+
+    def write(sheet):
+        data = [
+            {"range": f"'{sheet.title}'!C{name_id}:L{name_id}", "values": [_state_to_row(state)]}
+            for name_id, state in rows
+        ]
+        sheet.spreadsheet.values_batch_update({"valueInputOption": "RAW", "data": data})
+        return data
 
-    name_id = NAME_MAP.get(name)
+    try:
+        data = _with_sheet(write)
+        current_app.logger.info(f"gsheet batch updated {len(data)} rows: {[d['range'] for d in data]}")
+        for name_id, state in rows:
+            sheet_snapshot.record(name_id, state, written=True)
+    except Exception as e:
+        current_app.logger.error(e)
+        results = {name: False for name in results}
+    return results
+
+
+def update_gsheet_checkbox_batch(name, state):
+    name_id = _row_for(name)
     if name_id:
         try:
-            update_values = []
-            for e in 'CDEFGHIJKL':
-                if e in state:
-                    update_values.append(True)
-                else:
-                    update_values.append(False)
-            print(update_values)
-            spreadsheet = client.open_by_key(sheet_key)
-            sheet = spreadsheet.worksheet(sheet_name)
-            sheet.update(f"C{name_id}:L{name_id}", [update_values])
+            update_values = _state_to_row(state)
+            _with_sheet(lambda sheet: sheet.update(f"C{name_id}:L{name_id}", [update_values]))
             current_app.logger.info(f"gsheet updated at {name_id}, value: {update_values}")
         except Exception as e:
-            print('error what')
             current_app.logger.error(e)
-    else:
-        current_app.logger.info(f'{name} doesnt have name_id, please add to mapping')
\ No newline at end of file
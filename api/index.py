@@ -1,24 +1,65 @@
 import os
+import hmac
+import json
+import time
+import random
 import datetime
-from flask import Flask, request, abort, jsonify
 
-from linebot import LineBotApi, WebhookHandler
+from api import startup
+startup.install()
+
+from flask import Flask, request, abort, jsonify, g, Response
+
 from linebot.exceptions import InvalidSignatureError
 from linebot.models import MessageEvent, TextMessage, \
     TextSendMessage, PostbackEvent, FollowEvent, TemplateSendMessage, \
     ButtonsTemplate, URIAction
-from api.flex_messages import create_all_counter_message
-from api.gsheet import update_gsheet_checkbox_batch
-from api.gsheet import get_related_names_for
+from api.flex_messages import create_all_counter_message, create_plan_summary_message
+from api.gsheet import update_gsheet_checkboxes
+from api.gsheet import get_related_names_for, current_state_for
+from api.postback import normalize_state
 from api.db import User
-from api.gcal import parse_event_text, create_calendar_event, list_events_next_days
+from api.profiles import ProfileCache
+from api.deferred import deferred
+from api.broadcast import broadcast
+from api.postback import decode_postback
+from api.attendance import record_checkin, flush_to_sheet, on_flush_failure, unflushed_names
+from api.resilience import CircuitOpenError, guard_stats
+from api.webhook import DedupWebhookHandler
+from api.transport import create_line_bot_api
+from api.metrics import observe_handler, register_collector, hit_ratio_samples, expose
+from api.flex_messages import counter_cache_stats
+from api.dedup import deduplicator
+from api import profiling
+from api.commands import commands
+from api.gcal import parse_event_text, create_calendar_event, create_calendar_events, \
+    list_upcoming_events, CALENDAR_BATCH_LIMIT
 
 # from dotenv import load_dotenv
 # load_dotenv()
 
 
-line_bot_api = LineBotApi(os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
-line_handler = WebhookHandler(os.getenv("LINE_CHANNEL_SECRET"))
+line_bot_api = create_line_bot_api(os.getenv("LINE_CHANNEL_ACCESS_TOKEN"))
+line_handler = DedupWebhookHandler(os.getenv("LINE_CHANNEL_SECRET"))
+
+
+def _lookup_name_in_db(user_id):
+    return User(user_id, None, None).fetch_name()
+
+
+def _store_name_in_db(user_id, name):
+    User(user_id, None, name).update_name()
+
+
+_use_db_names = os.getenv("PROFILE_CACHE_USE_DB", "1") == "1"
+profile_cache = ProfileCache(
+    line_bot_api.get_profile,
+    secondary=_lookup_name_in_db if _use_db_names else None,
+    on_changed=_store_name_in_db if _use_db_names else None,
+    # Stored names are re-checked against LINE after the reply.
+    schedule=deferred.submit,
+    ttl=int(os.getenv("PROFILE_CACHE_TTL", "600")),
+)
 
 EVENT_DATA = [
         {'C': '主日', 'D': '禱告聚會', 'H': '小排'},
@@ -26,46 +67,44 @@ EVENT_DATA = [
         {'I': '傳福音', 'J': '1分禱告', 'K': '個禱'}
     ]
 
+CHECKIN_EVENT_IDS = frozenset(event_id for box in EVENT_DATA for event_id in box)
+
 app = Flask(__name__)
 
-def parse_data(input_string):
-    pairs = input_string.split('&')
-    result = {}
+DEFERRED_DRAIN_TIMEOUT = float(os.getenv("DEFERRED_DRAIN_TIMEOUT", "8"))
+# Fraction of webhook requests that get a structured log line.
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.05"))
 
-    for pair in pairs:
-        if not pair:
-            continue
-        parts = pair.split(':', 1)
-        if len(parts) != 2:
-            continue
-        key, value = parts
-        result[key] = value
-    return result
+
+def google_error_text(prefix, e):
+    "User-facing text for a failed Google call; details go to the log, not the chat."
+    if isinstance(e, CircuitOpenError):
+        return f"{prefix}：Google 服務暫時忙碌，請稍後再試。"
+    return f"{prefix}，請稍後再試。"
 
 
 # --- Message handlers ---
-def handle_plan_calendar_in_group(event):
-    is_group = getattr(event.source, 'type', None) == 'group' or hasattr(event.source, 'group_id')
-    if not is_group:
-        return False
-    text = event.message.text.strip()
-    if not (text.startswith("規劃：") or text.startswith("規劃:")):
-        return False
-    content = text.split("：", 1)[1] if "：" in text else text.split(":", 1)[1]
-    content = content.strip()
+@commands.command(prefixes=("規劃：", "規劃:"), scopes=("group",))
+def handle_plan_calendar_in_group(event, cmd):
+    content = cmd.args
+    lines = [line.strip() for line in content.splitlines() if line.strip()]
+    if len(lines) > 1:
+        handle_plan_calendar_batch(event, lines)
+        return
     parsed = parse_event_text(content)
     if not parsed:
         line_bot_api.reply_message(
             event.reply_token,
             TextSendMessage(text="格式錯誤：請在『規劃：』後面加上日期，例：規劃：9/10 19:30 小排")
         )
-        return True
+        return
     try:
         created = create_calendar_event(
             summary=parsed["title"],
             start_dt=parsed["start_dt"],
             end_dt=parsed["end_dt"],
             date=parsed["date"],
+            event_key=getattr(event, 'webhook_event_id', None),
         )
         html_link = created.get('htmlLink', '')
         # msg = f"已建立活動：{parsed['title']}\n"
@@ -89,92 +128,123 @@ def handle_plan_calendar_in_group(event):
             line_bot_api.reply_message(event.reply_token, btn_msg)
         else:
             line_bot_api.reply_message(event.reply_token, TextSendMessage(text=msg))
-        return True
     except Exception as e:
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"建立行事曆失敗：{e}"))
-        return True
+        app.logger.error(f"create_calendar_event failed: {e!r}")
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=google_error_text("建立行事曆失敗", e)))
+
+
+def format_event_when(parsed):
+    if parsed["all_day"]:
+        return parsed['date'].isoformat()
+    return f"{parsed['start_dt'].strftime('%Y/%m/%d %H:%M')} - {parsed['end_dt'].strftime('%H:%M')}"
 
 
-def handle_checkin_command(event):
-    if event.message.text != "點名":
-        return False
+def handle_plan_calendar_batch(event, lines):
+    "One event per line, created with a single Calendar batch request."
+    if len(lines) > CALENDAR_BATCH_LIMIT:
+        line_bot_api.reply_message(
+            event.reply_token,
+            TextSendMessage(text=f"一次最多規劃 {CALENDAR_BATCH_LIMIT} 個活動。")
+        )
+        return
+    rows = []
+    to_create = []
+    for line in lines:
+        try:
+            parsed = parse_event_text(line)
+        except ValueError:
+            parsed = None
+        if not parsed:
+            rows.append({'line': line, 'error': '格式錯誤'})
+            continue
+        row = {'line': line, 'title': parsed['title'], 'when': format_event_when(parsed)}
+        rows.append(row)
+        to_create.append((row, parsed))
+
+    if to_create:
+        try:
+            results = create_calendar_events(
+                [parsed for _, parsed in to_create],
+                event_key=getattr(event, 'webhook_event_id', None),
+            )
+        except Exception as e:
+            app.logger.error(f"create_calendar_events failed: {e!r}")
+            results = [(None, e)] * len(to_create)
+        for (row, _), (created, error) in zip(to_create, results):
+            if error is not None:
+                app.logger.error(f"calendar insert failed for {row['line']!r}: {error!r}")
+                row['error'] = google_error_text('建立失敗', error)
+            else:
+                row['link'] = created.get('htmlLink', '')
+
+    line_bot_api.reply_message(event.reply_token, create_plan_summary_message(rows))
+
+
+@commands.command("點名", scopes=("user",))
+def handle_checkin_command(event, cmd):
     user_id = event.source.user_id
-    profile = line_bot_api.get_profile(user_id)
-    name = profile.display_name
+    name = profile_cache.get_display_name(user_id)
     related_names = get_related_names_for(name)
+    # Open the card on what they've already checked this week, limited to
+    # the events the card has buttons for.
+    try:
+        state = current_state_for(name, user_id, allow_stale=True) or ""
+    except Exception as e:
+        app.logger.error(f"sheet snapshot lookup failed: {e!r}")
+        state = ""
+    state = ''.join(e for e in state if e in CHECKIN_EVENT_IDS)
     line_bot_api.reply_message(
         event.reply_token,
-        create_all_counter_message('週點名', EVENT_DATA, state="", related_names=related_names, selected_related=[name], self_name=name)
+        create_all_counter_message('週點名', EVENT_DATA, state=state, related_names=related_names, selected_related=[name], self_name=name)
     )
-    print(datetime.datetime.now(), "replied message")
-    return True
 
 
-def handle_notify_me_command(event):
-    if event.message.text != "通知我":
-        return False
+@commands.command("通知我")
+def handle_notify_me_command(event, cmd):
     user_id = event.source.user_id
-    profile = line_bot_api.get_profile(user_id)
-    name = profile.display_name
+    name = profile_cache.get_display_name(user_id)
     user = User(user_id, None, name)
     user.add_user()
     message = TextSendMessage(
         text=f'{name} 已加入點名通知清單！'
     )
     line_bot_api.reply_message(event.reply_token, message)
-    return True
 
 
-def handle_help_command(event):
-    if event.message.text != "機器人功能":
-        return False
+@commands.command("機器人功能")
+def handle_help_command(event, cmd):
     help_text = (
         "機器人功能\n"
         "1) 點名：輸入『點名』開啟週點名選單，勾選後按『確認送出』一次回報。\n"
         "2) 行事曆規劃：在群組中以『規劃：』或『規劃:』開頭，接活動名稱與日期（可含時間），自動建立 Google 行事曆活動。\n"
         "   範例：規劃：9/10 19:30 小排\n"
+        "   一次規劃多個活動：每行一個，例：規劃：9/10 19:30 小排（換行）9/17 19:30 小排\n"
         "   提醒：行事曆功能僅在群組訊息生效。\n"
         "3) 通知我：將你加入每週點名提醒名單。\n"
+        "4) 活動列表：列出未來30天的活動，可指定天數，例：活動列表 7\n"
     )
     line_bot_api.reply_message(event.reply_token, TextSendMessage(text=help_text))
-    return True
 
 
-# --- Routers ---
-def handle_group_text_message(event):
-    if handle_plan_calendar_in_group(event):
-        return True
-    if handle_notify_me_command(event):
-        return True
-    if handle_help_command(event):
-        return True
-    if handle_list_events(event):
-        return True
-    return False
-
-
-def handle_user_text_message(event):
-    if handle_checkin_command(event):
-        return True
-    if handle_notify_me_command(event):
-        return True
-    if handle_help_command(event):
-        return True
-    if handle_list_events(event):
-        return True
-    return False
+LIST_EVENTS_LIMIT = 20
 
 
-def handle_list_events(event):
-    if event.message.text != "活動列表":
-        return False
+@commands.command("活動列表", takes_args=True)
+def handle_list_events(event, cmd):
+    # 活動列表 [days], e.g. 活動列表 7
+    days = 30
+    if cmd.args:
+        if not cmd.args.isdigit() or not 1 <= int(cmd.args) <= 365:
+            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="格式錯誤：請輸入 活動列表 或 活動列表 天數（1-365），例：活動列表 7"))
+            return
+        days = int(cmd.args)
     try:
-        events = list_events_next_days(30)
+        events = list_upcoming_events(days, limit=LIST_EVENTS_LIMIT)
         if not events:
-            line_bot_api.reply_message(event.reply_token, TextSendMessage(text="未找到未來30天的活動。"))
-            return True
-        lines = ["未來30天活動："]
-        for e in events[:20]:
+            line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"未找到未來{days}天的活動。"))
+            return
+        lines = [f"未來{days}天活動："]
+        for e in events:
             if e["is_all_day"]:
                 lines.append(f"- {e['start']}：{e['summary']}")
             else:
@@ -187,10 +257,21 @@ def handle_list_events(event):
                     lines.append(f"- {e['start']}：{e['summary']}")
         text = "\n".join(lines)
         line_bot_api.reply_message(event.reply_token, TextSendMessage(text=text))
-        return True
     except Exception as exc:
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=f"取得活動失敗：{exc}"))
-        return True
+        app.logger.error(f"list_upcoming_events failed: {exc!r}")
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=google_error_text("取得活動失敗", exc)))
+
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def _record_startup(response):
+    if startup.first_request is None:
+        startup.record_first_request(time.perf_counter() - g.request_started)
+    return response
+
 
 # domain root
 @app.route('/')
@@ -203,19 +284,28 @@ def callback():
     signature = request.headers['X-Line-Signature']
     # get request body as text
     body = request.get_data(as_text=True)
-    app.logger.info("Request body: " + body)
     # handle webhook body
     try:
-        line_handler.handle(body, signature)
+        with profiling.maybe_profile(profiling.should_profile(request.headers, body), "webhook") as profiled:
+            timings = line_handler.handle(body, signature, concurrent=not profiled)
     except InvalidSignatureError:
         abort(400)
-    return 'OK'
+    if random.random() < LOG_SAMPLE_RATE:
+        app.logger.info(json.dumps({
+            "msg": "webhook",
+            "bytes": len(body),
+            "ms": round((time.perf_counter() - g.request_started) * 1000, 1),
+            "events": [{"type": t["type"], "handler_ms": round(t["handler_ms"], 1)} for t in timings],
+        }, ensure_ascii=False))
+    # Replies are already out; finish deferred writes before the instance may freeze.
+    response = app.make_response('OK')
+    response.call_on_close(lambda: deferred.drain(DEFERRED_DRAIN_TIMEOUT))
+    return response
 
 @line_handler.add(FollowEvent)
 def handle_follow(event):
     user_id = event.source.user_id
-    profile = line_bot_api.get_profile(user_id)
-    name = profile.display_name
+    name = profile_cache.get_display_name(user_id)
     user = User(user_id, None, name)
     user.add_user()
     welcome_message = TextSendMessage(
@@ -231,12 +321,9 @@ def handle_message(event):
 
     # Delegate by chat type
     source_type = getattr(event.source, 'type', None)
-    if source_type == 'group' or hasattr(event.source, 'group_id'):
-        if handle_group_text_message(event):
-            return
-    else:
-        if handle_user_text_message(event):
-            return
+    scope = 'group' if source_type == 'group' or hasattr(event.source, 'group_id') else 'user'
+    if commands.dispatch(event, event.message.text, scope):
+        return
 
 
     # TODO: Add english version
@@ -271,12 +358,86 @@ def handle_message(event):
 def weekly_job_handler():
     print("weekly triggered")
     user = User(None, None, None)
-    user_id_list = user.fetch_all_user_ids()
-    line_bot_api.multicast(
-        user_id_list,
+    summary = broadcast(
+        line_bot_api,
+        user.iter_user_id_chunks(),
         create_all_counter_message(f'嗨～來週點名囉～', EVENT_DATA, state="")
     )
-    return jsonify({"message": "Cron job executed successfully!"}), 200
+    return jsonify({"message": "Cron job executed successfully!", "summary": summary}), 200
+
+CRON_SECRET = os.getenv("CRON_SECRET", "")
+
+
+def cron_authorized(headers):
+    "Vercel Cron sends `Authorization: Bearer $CRON_SECRET`; the admin token also works, for manual runs."
+    if profiling.authorized(headers):
+        return True
+    return bool(CRON_SECRET) and hmac.compare_digest(headers.get("Authorization", ""), f"Bearer {CRON_SECRET}")
+
+@app.route("/api/flush", methods=['GET'])
+def flush_attendance_handler():
+    if not cron_authorized(request.headers):
+        abort(404)
+    results = flush_to_sheet()
+    return jsonify({"flushed": [n for n, ok in results.items() if ok], "failed": [n for n, ok in results.items() if not ok]}), 200
+
+@register_collector
+def _cache_metrics():
+    samples = hit_ratio_samples("profile", profile_cache.stats["hits"] + profile_cache.stats["secondary_hits"],
+                                profile_cache.stats["misses"] - profile_cache.stats["secondary_hits"])
+    samples += hit_ratio_samples("flex_counter", counter_cache_stats["hits"], counter_cache_stats["misses"])
+    samples += hit_ratio_samples("webhook_dedup", deduplicator.stats["duplicates"], deduplicator.stats["claimed"])
+    return samples
+
+
+@register_collector
+def _google_guard_metrics():
+    samples = []
+    for service, stats in guard_stats().items():
+        samples.append(("google_circuit_open", {"service": service}, 1 if stats["state"] == "open" else 0))
+        for counter in ("calls", "retries", "failures", "short_circuited"):
+            samples.append((f"google_{counter}", {"service": service}, stats[counter]))
+    return samples
+
+
+@app.route("/metrics", methods=['GET'])
+def metrics_handler():
+    if not profiling.authorized(request.headers):
+        abort(404)
+    return expose(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+@app.route("/admin/profiles", methods=['GET'])
+def list_profiles_handler():
+    if not profiling.authorized(request.headers):
+        abort(404)
+    return jsonify(profiling.list_profiles()), 200
+
+@app.route("/admin/profiles/<profile_id>", methods=['GET'])
+def get_profile_handler(profile_id):
+    if not profiling.authorized(request.headers):
+        abort(404)
+    profile = profiling.get_profile(profile_id)
+    if profile is None:
+        abort(404)
+    # ?format=prof returns a file loadable with pstats.Stats / snakeviz
+    if request.args.get("format") == "prof":
+        return Response(profile["stats"], mimetype="application/octet-stream", headers={
+            "Content-Disposition": f"attachment; filename=webhook-{profile_id}.prof"})
+    return Response(profile["report"], mimetype="text/plain")
+
+@app.route("/api/command-stats", methods=['GET'])
+def command_stats_handler():
+    if not profiling.authorized(request.headers):
+        abort(404)
+    return jsonify(commands.stats), 200
+
+@app.route("/api/google-stats", methods=['GET'])
+def google_stats_handler():
+    if not profiling.authorized(request.headers):
+        abort(404)
+    return jsonify(guard_stats()), 200
+
+POSTBACK_ACTION_NAMES = {'r': 'record', 'n': 'next', 's': 'toggle_related'}
 
 @line_handler.add(PostbackEvent)
 def handle_postback(event):
@@ -284,15 +445,23 @@ def handle_postback(event):
     data = event.postback.data
     group_id = getattr(event.source, 'group_id', None)
     user_id = event.source.user_id
-    parsed_data = parse_data(data)
+    if data.startswith('action:'):
+        parsed_data = decode_postback(data)
+    else:
+        name = profile_cache.get_display_name(user_id)
+        parsed_data = decode_postback(data, [name] + get_related_names_for(name))
     action_type = parsed_data.get('action')
 
+    started = time.perf_counter()
     if action_type == 'r':
         handle_gsheet_record(event, parsed_data, user_id, group_id)
     elif action_type == 'n':
         next_question(event, parsed_data)
     elif action_type == 's':
         toggle_related(event, parsed_data)
+    else:
+        return
+    observe_handler("postback", POSTBACK_ACTION_NAMES[action_type], time.perf_counter() - started)
 
 
 def next_question(event, parsed_data):
@@ -300,8 +469,7 @@ def next_question(event, parsed_data):
     rels = parsed_data.get('rels') or ""
     selected_related = [r for r in rels.split(',') if r]
     user_id = event.source.user_id
-    profile = line_bot_api.get_profile(user_id)
-    name = profile.display_name
+    name = profile_cache.get_display_name(user_id)
     related_names = get_related_names_for(name)
     if not selected_related:
         selected_related = [name]
@@ -332,22 +500,82 @@ def handle_gsheet_record(event, parsed_data, user_id, group_id):
     #     group_id = event.source.group_id
     #     profile = line_bot_api.get_group_member_profile(group_id, user_id)
     # else:
-    profile = line_bot_api.get_profile(user_id)
-
-    user_name = profile.display_name
+    user_name = profile_cache.get_display_name(user_id)
     selected_related = [r for r in rels.split(',') if r]
     if not selected_related:
         selected_related = [user_name]
     target_names = selected_related
 
-    for tname in target_names:
-        update_gsheet_checkbox_batch(tname, state)
-    checked_events = ', '.join([event_map[id] for id in state])
+    unchanged = [
+        tname for tname in target_names
+        if not _state_changed(tname, state, user_id if tname == user_name else None)
+    ]
+    # The snapshot can't be trusted for names the ledger hasn't flushed yet.
+    unchanged = set(unchanged) - _unflushed(unchanged)
+    states = {tname: state for tname in target_names if tname not in unchanged}
+    ledger_ok = True
+    if states:
+        try:
+            # The ledger insert is the record; the sheet is flushed from it in the background.
+            record_checkin(states, user_id)
+        except Exception as e:
+            app.logger.error(f"attendance ledger write failed: {e}")
+            ledger_ok = False
+    else:
+        app.logger.info(f"check-in unchanged for {target_names}, skipping writes")
+
+    checked_events = ', '.join([event_map[id] for id in state if id in event_map])
     names_str = '、'.join(target_names)
+    # Reply before touching Sheets so a slow write can't expire the reply token.
     line_bot_api.reply_message(
         event.reply_token,
         TextSendMessage(text=f"{names_str} 於 {checked_events} 簽到了～")
     )
+    if not ledger_ok:
+        deferred.submit(
+            record_checkins, user_id, states,
+            on_error=lambda e: notify_checkin_failed(user_id, list(states)),
+        )
+
+
+def _state_changed(name, state, user_id=None):
+    "False only when the sheet snapshot already holds exactly `state` for `name`."
+    try:
+        current = current_state_for(name, user_id)
+    except Exception as e:
+        app.logger.error(f"sheet snapshot lookup failed: {e!r}")
+        return True
+    return current is None or current != normalize_state(state)
+
+
+def _unflushed(names):
+    try:
+        return unflushed_names(names)
+    except Exception as e:
+        app.logger.error(f"attendance ledger lookup failed: {e!r}")
+        return set(names)
+
+
+def record_checkins(user_id, states):
+    with app.app_context():
+        results = update_gsheet_checkboxes(states)
+    failed = [n for n in states if not results.get(n)]
+    if failed:
+        notify_checkin_failed(user_id, failed)
+
+
+def notify_checkin_failed(user_id, names):
+    line_bot_api.push_message(
+        user_id,
+        TextSendMessage(text=f"{'、'.join(names)} 簽到失敗，請稍後再試一次。")
+    )
+
+
+@on_flush_failure
+def notify_flush_failed(names_by_recorder):
+    for user_id, names in names_by_recorder.items():
+        if user_id:
+            notify_checkin_failed(user_id, names)
 
 
 def toggle_related(event, parsed_data):
@@ -361,8 +589,7 @@ def toggle_related(event, parsed_data):
         sel.append(target)
 
     user_id = event.source.user_id
-    profile = line_bot_api.get_profile(user_id)
-    name = profile.display_name
+    name = profile_cache.get_display_name(user_id)
     related_names = get_related_names_for(name)
     line_bot_api.reply_message(
         event.reply_token,
@@ -0,0 +1,114 @@
+"""
+In-process metrics with a Prometheus text exposition, for the /metrics route.
+
+- `span(service, op)` times an outbound call into `outbound_call_seconds`.
+- `observe_handler(kind, name, seconds)` feeds `handler_seconds` for
+  commands and postback actions.
+- `register_collector(fn)` adds gauges computed at scrape time (cache hit
+  ratios, circuit breaker counters, ...); `fn` returns
+  [(metric_name, {label: value}, number)].
+"""
+import time
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}  # sorted label items -> [bucket counts..., count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += seconds
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in self._series.items()]
+        for key, series in items:
+            for bound, count in zip(self.buckets, series):
+                lines.append(f"{self.name}_bucket{_labels(key + (('le', bound),))} {count}")
+            lines.append(f"{self.name}_bucket{_labels(key + (('le', '+Inf'),))} {series[-2]}")
+            lines.append(f"{self.name}_count{_labels(key)} {series[-2]}")
+            lines.append(f"{self.name}_sum{_labels(key)} {series[-1]:.6f}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(items):
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+outbound_call_seconds = Histogram("outbound_call_seconds", "Latency of calls to LINE, Google and Postgres.")
+handler_seconds = Histogram("handler_seconds", "Latency of webhook commands and postback actions.")
+_collectors = []
+
+
+@contextmanager
+def span(service, op):
+    "Time the enclosed outbound call; failures are labelled outcome=error."
+    start = time.perf_counter()
+    outcome = "ok"
+    try:
+        yield
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        outbound_call_seconds.observe(time.perf_counter() - start, service=service, op=op, outcome=outcome)
+
+
+def observe_handler(kind, name, seconds):
+    handler_seconds.observe(seconds, kind=kind, name=name)
+
+
+def register_collector(fn):
+    _collectors.append(fn)
+    return fn
+
+
+def hit_ratio_samples(cache, hits, misses):
+    "Gauges for a cache's hit/miss counters and their ratio."
+    total = hits + misses
+    return [
+        ("cache_hits", {"cache": cache}, hits),
+        ("cache_misses", {"cache": cache}, misses),
+        ("cache_hit_ratio", {"cache": cache}, hits / total if total else 0.0),
+    ]
+
+
+def expose():
+    lines = outbound_call_seconds.expose() + handler_seconds.expose()
+    families = {}  # Prometheus wants each metric's samples grouped together
+    for collector in _collectors:
+        try:
+            samples = collector()
+        except Exception as e:
+            print(f"metrics collector {collector.__name__} failed: {e}")
+            continue
+        for name, labels, value in samples:
+            families.setdefault(name, []).append((labels, value))
+    for name, samples in families.items():
+        lines.append(f"# TYPE {name} gauge")
+        for labels, value in samples:
+            lines.append(f"{name}{_labels(tuple(sorted(labels.items())))} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,86 @@
+"""
+Postback data encoding for the check-in card.
+
+Version 2 payloads look like `2|n|5|3|1`:
+    version | action | event bitmask (hex) | selected-member bitmask (hex) | target index
+
+Event bits follow the sheet columns in EVENT_COLUMNS; member bits and the
+target index point into the participant list `[self_name] + related_names`,
+so payload size no longer grows with display-name length. Legacy
+`action:n&state:CD&rels:a,b` payloads are still accepted.
+"""
+
+EVENT_COLUMNS = 'CDEFGHIJKL'
+VERSION = '2'
+_EVENT_BITS = {col: 1 << i for i, col in enumerate(EVENT_COLUMNS)}
+
+
+def state_to_mask(state):
+    mask = 0
+    for event_id in state or '':
+        mask |= _EVENT_BITS.get(event_id, 0)
+    return mask
+
+
+def mask_to_state(mask):
+    return ''.join(col for col in EVENT_COLUMNS if mask & _EVENT_BITS[col])
+
+
+def normalize_state(state):
+    "Deduplicate and order a state string by sheet column."
+    return mask_to_state(state_to_mask(state))
+
+
+def toggle_event(state, event_id):
+    return mask_to_state(state_to_mask(state) ^ _EVENT_BITS[event_id])
+
+
+def encode_postback(action, state, participants=(), selected=(), target=None):
+    rel_mask = 0
+    for i, name in enumerate(participants):
+        if name in selected:
+            rel_mask |= 1 << i
+    target_idx = participants.index(target) if target in participants else ''
+    return f"{VERSION}|{action}|{state_to_mask(state):x}|{rel_mask:x}|{target_idx}"
+
+
+def parse_data(input_string):
+    pairs = input_string.split('&')
+    result = {}
+
+    for pair in pairs:
+        if not pair:
+            continue
+        parts = pair.split(':', 1)
+        if len(parts) != 2:
+            continue
+        key, value = parts
+        result[key] = value
+    return result
+
+
+def decode_postback(data, participants=()):
+    """
+    Decode either payload version into the legacy dict shape:
+    {'action', 'state', 'rels' (comma-joined names), 'target'}.
+    """
+    if not data.startswith(VERSION + '|'):
+        result = parse_data(data)
+        if 'state' in result:
+            result['state'] = normalize_state(result['state'])
+        return result
+
+    fields = data.split('|')
+    if len(fields) != 5:
+        return {}
+    _, action, state_hex, rel_hex, target_idx = fields
+    try:
+        state_mask = int(state_hex, 16)
+        rel_mask = int(rel_hex, 16)
+    except ValueError:
+        return {}
+    rels = [name for i, name in enumerate(participants) if rel_mask >> i & 1]
+    result = {'action': action, 'state': mask_to_state(state_mask), 'rels': ','.join(rels)}
+    if target_idx.isdigit() and int(target_idx) < len(participants):
+        result['target'] = participants[int(target_idx)]
+    return result
@@ -0,0 +1,104 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class ProfileCache:
+    """
+    TTL + LRU cache of LINE display names keyed by user_id.
+
+    Lookups go memory -> `secondary` (e.g. the Postgres users table) ->
+    `fetch_profile` (LINE API). A stored name is served right away and, if
+    `schedule` is given, re-checked against LINE in the background
+    (stale-while-revalidate); a changed name replaces the cached one and is
+    passed to `on_changed` so the store catches up. Failed lookups are cached
+    for `negative_ttl` seconds so a broken user_id doesn't hit LINE on every tap.
+    """
+    def __init__(self, fetch_profile, secondary=None, on_changed=None, schedule=None,
+                 ttl=600, negative_ttl=60, max_size=512):
+        self.fetch_profile = fetch_profile
+        self.secondary = secondary
+        self.on_changed = on_changed
+        self.schedule = schedule
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # user_id -> (name or None, expires_at)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "negative_hits": 0, "secondary_hits": 0,
+                      "revalidated": 0, "errors": 0}
+
+    def _get_entry(self, user_id, now):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[1] <= now:
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry
+
+    def _put(self, user_id, name, ttl):
+        with self._lock:
+            self._entries[user_id] = (name, time.monotonic() + ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_display_name(self, user_id):
+        entry = self._get_entry(user_id, time.monotonic())
+        if entry is not None:
+            if entry[0] is None:
+                self.stats["negative_hits"] += 1
+                raise LookupError(f"Profile lookup for {user_id} recently failed.")
+            self.stats["hits"] += 1
+            return entry[0]
+
+        self.stats["misses"] += 1
+        stored = self._secondary_name(user_id)
+        if stored:
+            self.stats["secondary_hits"] += 1
+            self._put(user_id, stored, self.ttl)
+            if self.schedule is not None:
+                self.schedule(self._revalidate, user_id, stored)
+            return stored
+
+        try:
+            name = self.fetch_profile(user_id).display_name
+        except Exception:
+            self.stats["errors"] += 1
+            self._put(user_id, None, self.negative_ttl)
+            raise
+        self._put(user_id, name, self.ttl)
+        return name
+
+    def _revalidate(self, user_id, stored):
+        "Ask LINE for the current name behind a stored one; update both if it changed."
+        try:
+            name = self.fetch_profile(user_id).display_name
+        except Exception as e:
+            print(f"Profile revalidation failed: {e}")
+            return
+        if name == stored:
+            return
+        self.stats["revalidated"] += 1
+        self._put(user_id, name, self.ttl)
+        if self.on_changed is not None:
+            self.on_changed(user_id, name)
+
+    def _secondary_name(self, user_id):
+        if self.secondary is None:
+            return None
+        try:
+            return self.secondary(user_id)
+        except Exception as e:
+            print(f"Profile secondary lookup failed: {e}")
+            return None
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
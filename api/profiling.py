@@ -0,0 +1,103 @@
+"""
+On-demand cProfile for production webhook requests.
+
+A request is profiled when PROFILE_SAMPLE_RATE=N is set and it is the Nth
+request, or when it carries `X-Profile-Signature: hex(HMAC-SHA256(
+PROFILE_SECRET, body))`. Only the slowest PROFILE_KEEP profiles are kept in
+memory; they can be listed and downloaded from /admin/profiles with
+`Authorization: Bearer $PROFILE_ADMIN_TOKEN`. The same token guards
+/metrics and the /api/*-stats endpoints.
+"""
+import io
+import os
+import hmac
+import time
+import uuid
+import heapq
+import marshal
+import pstats
+import hashlib
+import cProfile
+import itertools
+import threading
+import datetime as dt
+from contextlib import contextmanager
+
+SAMPLE_RATE = int(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+SECRET = os.getenv("PROFILE_SECRET", "")
+ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+KEEP = int(os.getenv("PROFILE_KEEP", "10"))
+
+_counter = itertools.count(1)
+_profiles = []  # min-heap of (duration, seq, profile dict): the fastest is evicted first
+_profiles_lock = threading.Lock()
+# Only one cProfile can be active per process, so concurrent requests skip profiling.
+_active = threading.Lock()
+
+
+def should_profile(headers, body):
+    if SAMPLE_RATE > 0 and next(_counter) % SAMPLE_RATE == 0:
+        return True
+    signature = headers.get("X-Profile-Signature")
+    if SECRET and signature:
+        expected = hmac.new(SECRET.encode(), body.encode(), hashlib.sha256).hexdigest()
+        return hmac.compare_digest(signature, expected)
+    return False
+
+
+def _store(profile):
+    with _profiles_lock:
+        entry = (profile["duration_ms"], profile["id"], profile)
+        if len(_profiles) < KEEP:
+            heapq.heappush(_profiles, entry)
+        elif entry > _profiles[0]:
+            heapq.heapreplace(_profiles, entry)
+
+
+@contextmanager
+def maybe_profile(enabled, label):
+    "Profile the enclosed block when `enabled`; yields whether it is being profiled."
+    if not enabled or not _active.acquire(blocking=False):
+        yield False
+        return
+    profiler = cProfile.Profile()
+    started = time.perf_counter()
+    try:
+        profiler.enable()
+        try:
+            yield True
+        finally:
+            profiler.disable()
+        duration = time.perf_counter() - started
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats("cumulative").print_stats(40)
+        profiler.create_stats()
+        _store({
+            "id": uuid.uuid4().hex[:12],
+            "label": label,
+            "recorded_at": dt.datetime.now(dt.timezone.utc).isoformat(),
+            "duration_ms": round(duration * 1000, 1),
+            "report": report.getvalue(),
+            "stats": marshal.dumps(profiler.stats),
+        })
+    finally:
+        _active.release()
+
+
+def authorized(headers):
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(headers.get("Authorization", ""), f"Bearer {ADMIN_TOKEN}")
+
+
+def list_profiles():
+    "Kept profiles, slowest first, without their payloads."
+    with _profiles_lock:
+        entries = sorted(_profiles, reverse=True)
+    return [{k: v for k, v in p.items() if k not in ("report", "stats")} for _, _, p in entries]
+
+
+def get_profile(profile_id):
+    with _profiles_lock:
+        for _, _, profile in _profiles:
+            if profile["id"] == profile_id:
+                return profile
+    return None
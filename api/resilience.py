@@ -0,0 +1,173 @@
+"""
+Shared guard for outbound Google calls: a client-side token bucket sized to
+the API quota, jittered exponential backoff on retryable status codes, and a
+circuit breaker that fails fast while Google keeps erroring.
+"""
+import os
+import time
+import random
+import threading
+
+from api.ratelimit import TokenBucket
+from api.metrics import span
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    "Raised without calling Google while the circuit breaker is open."
+
+
+def _status_code(e):
+    # gspread.exceptions.APIError carries a requests response.
+    response = getattr(e, 'response', None)
+    code = getattr(response, 'status_code', None)
+    if code is not None:
+        return code
+    # googleapiclient.errors.HttpError carries an httplib2 response.
+    resp = getattr(e, 'resp', None)
+    status = getattr(resp, 'status', None)
+    return int(status) if status is not None else None
+
+
+_network_errors = None
+
+
+def _transport_errors():
+    """
+    Network failures from the HTTP stacks under gspread (requests) and
+    googleapiclient (httplib2), plus google-auth token refreshes. None of
+    them subclass the builtin ConnectionError; imported on first failure.
+    """
+    global _network_errors
+    if _network_errors is None:
+        import socket
+        errors = [ConnectionError, TimeoutError, socket.timeout, socket.gaierror]
+        try:
+            import requests
+            errors.append(requests.exceptions.RequestException)
+        except ImportError:  # pragma: no cover
+            pass
+        try:
+            import httplib2
+            errors.append(httplib2.HttpLib2Error)
+        except ImportError:  # pragma: no cover
+            pass
+        try:
+            from google.auth.exceptions import TransportError
+            errors.append(TransportError)
+        except ImportError:  # pragma: no cover
+            pass
+        _network_errors = tuple(errors)
+    return _network_errors
+
+
+def is_retryable(e):
+    code = _status_code(e)
+    if code is not None:
+        return code in RETRYABLE_STATUS
+    return isinstance(e, _transport_errors())
+
+
+def is_conflict(e):
+    "409: e.g. an insert whose client-chosen id already exists."
+    return _status_code(e) == 409
+
+
+def _op_name(fn):
+    # googleapiclient requests carry their method id, e.g. calendar.events.list.
+    method_id = getattr(getattr(fn, '__self__', None), 'methodId', None)
+    if method_id:
+        return method_id
+    name = getattr(fn, '__name__', 'call')
+    return 'call' if name == '<lambda>' else name
+
+
+class GoogleCallGuard:
+    def __init__(self, name, per_minute, burst=None, max_retries=4, base_delay=0.5, max_delay=8,
+                 failure_threshold=5, reset_timeout=30):
+        self.name = name
+        self.bucket = TokenBucket(per_minute / 60.0, burst or max(1, per_minute // 6))
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+        self.counters = {
+            "calls": 0, "successes": 0, "retries": 0, "failures": 0,
+            "short_circuited": 0, "circuit_opened": 0,
+        }
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def _before_call(self):
+        with self._lock:
+            self.counters["calls"] += 1
+            if self.state == "open":
+                self.counters["short_circuited"] += 1
+                raise CircuitOpenError(f"{self.name} circuit is open, skipping call")
+
+    def _on_success(self):
+        with self._lock:
+            self.counters["successes"] += 1
+            self._consecutive_failures = 0
+            self._opened_at = None
+
+    def _on_failure(self):
+        with self._lock:
+            self.counters["failures"] += 1
+            self._consecutive_failures += 1
+            if self.state == "half-open" or self._consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.counters["circuit_opened"] += 1
+                self._opened_at = time.monotonic()
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Run `fn(*args, **kwargs)` under the rate limit, retrying retryable
+        errors. Non-retryable errors are raised right away and don't count
+        towards opening the circuit.
+        """
+        self._before_call()
+        op = _op_name(fn)
+        attempt = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                with span(self.name, op):
+                    result = fn(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                if attempt >= self.max_retries:
+                    self._on_failure()
+                    raise
+                delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+                time.sleep(random.uniform(0, delay))
+                attempt += 1
+                with self._lock:
+                    self.counters["retries"] += 1
+                continue
+            self._on_success()
+            return result
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters, state=self.state)
+
+
+sheets_guard = GoogleCallGuard("sheets", per_minute=int(os.getenv("SHEETS_QUOTA_PER_MINUTE", "60")))
+calendar_guard = GoogleCallGuard("calendar", per_minute=int(os.getenv("CALENDAR_QUOTA_PER_MINUTE", "600")))
+
+
+def guard_stats():
+    return {guard.name: guard.snapshot() for guard in (sheets_guard, calendar_guard)}
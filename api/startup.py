@@ -0,0 +1,81 @@
+"""
+Opt-in cold-start timing. With STARTUP_PROFILE=1, `install()` records how
+long each module takes to import (inclusive of the modules it imports) and
+`record_first_request()` logs a report after the first request, warning when
+it exceeds STARTUP_BUDGET_MS.
+"""
+import os
+import sys
+import time
+import threading
+import importlib.abc
+
+ENABLED = os.getenv("STARTUP_PROFILE") == "1"
+BUDGET_MS = float(os.getenv("STARTUP_BUDGET_MS", "0"))
+
+_started_at = time.perf_counter()
+import_times = {}  # module name -> seconds
+first_request = None
+_installed = False
+_report_lock = threading.Lock()
+
+
+class _TimedLoader(importlib.abc.Loader):
+    def __init__(self, loader):
+        self._loader = loader
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            import_times[module.__name__] = time.perf_counter() - start
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _TimedFinder(importlib.abc.MetaPathFinder):
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader)
+                return spec
+        return None
+
+
+def install():
+    global _installed
+    if ENABLED and not _installed:
+        sys.meta_path.insert(0, _TimedFinder())
+        _installed = True
+
+
+def report(top=15):
+    lines = [f"import {name}: {secs * 1000:.1f}ms"
+             for name, secs in sorted(import_times.items(), key=lambda kv: -kv[1])[:top]]
+    if first_request is not None:
+        since_start, duration = first_request
+        lines.append(f"first request: {duration * 1000:.1f}ms, {since_start * 1000:.1f}ms after process start")
+    return "\n".join(lines)
+
+
+def record_first_request(duration):
+    "Log the startup report once, after the first request finishes."
+    global first_request
+    if not ENABLED:
+        return
+    with _report_lock:
+        if first_request is not None:
+            return
+        first_request = (time.perf_counter() - _started_at, duration)
+    print("Startup timing:\n" + report())
+    if BUDGET_MS and first_request[0] * 1000 > BUDGET_MS:
+        print(f"Cold start took {first_request[0] * 1000:.0f}ms, over the {BUDGET_MS:.0f}ms budget")
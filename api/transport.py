@@ -0,0 +1,97 @@
+"""
+One connection-pooling HTTP layer for every outbound client, so repeated
+LINE and Google calls on a warm instance reuse TCP/TLS connections.
+
+- LINE: LineBotApi gets PooledRequestsHttpClient, backed by a shared
+  requests.Session (the SDK's default client opens a new connection per call).
+- gspread: gets an AuthorizedSession with the same adapter settings.
+- googleapiclient: httplib2 isn't thread-safe, so each thread keeps its own
+  AuthorizedHttp, whose connections stay open between calls.
+
+Neither requests nor httplib2 speaks HTTP/2, so connections are HTTP/1.1
+keep-alive.
+"""
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from linebot.http_client import RequestsHttpClient, RequestsHttpResponse
+
+from api.metrics import span
+
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+
+_session = None
+_session_lock = threading.Lock()
+_local = threading.local()
+
+
+def _mount_pool(session):
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=POOL_SIZE, max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+
+def get_session():
+    "Process-wide requests.Session with a bounded keep-alive pool."
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _mount_pool(requests.Session())
+    return _session
+
+
+def _line_op(url):
+    "Metric label for a LINE API URL, e.g. message/reply or profile/{id}."
+    segments = urlsplit(url).path.split('/')[3:]
+    return '/'.join('{id}' if len(seg) >= 20 else seg for seg in segments)
+
+
+class PooledRequestsHttpClient(RequestsHttpClient):
+    "line-bot-sdk HTTP client that sends through the shared session."
+    def _send(self, method, url, timeout, **kwargs):
+        with span("line", _line_op(url)):
+            response = get_session().request(method, url, timeout=timeout or self.timeout, **kwargs)
+        return RequestsHttpResponse(response)
+
+    def get(self, url, headers=None, params=None, stream=False, timeout=None):
+        return self._send("GET", url, timeout, headers=headers, params=params, stream=stream)
+
+    def post(self, url, headers=None, data=None, timeout=None):
+        return self._send("POST", url, timeout, headers=headers, data=data)
+
+    def delete(self, url, headers=None, data=None, timeout=None):
+        return self._send("DELETE", url, timeout, headers=headers, data=data)
+
+    def put(self, url, headers=None, data=None, timeout=None):
+        return self._send("PUT", url, timeout, headers=headers, data=data)
+
+
+def create_line_bot_api(channel_access_token):
+    from linebot import LineBotApi
+    return LineBotApi(channel_access_token, timeout=TIMEOUT, http_client=PooledRequestsHttpClient)
+
+
+def authorized_session(credentials):
+    "google-auth session for gspread with the shared pool settings."
+    from google.auth.transport.requests import AuthorizedSession
+    return _mount_pool(AuthorizedSession(credentials))
+
+
+def authorized_http(credentials):
+    "Per-thread httplib2 transport for googleapiclient `execute(http=...)`."
+    cache = getattr(_local, "http", None)
+    if cache is None:
+        cache = _local.http = {}
+    http = cache.get(id(credentials))
+    if http is None:
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        http = cache[id(credentials)] = AuthorizedHttp(credentials, http=httplib2.Http(timeout=TIMEOUT))
+    return http
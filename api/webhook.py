@@ -0,0 +1,127 @@
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from flask import current_app, has_app_context
+from linebot import WebhookHandler
+from linebot.models import MessageEvent
+
+from api.dedup import deduplicator
+
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("WEBHOOK_WORKERS", "4")),
+            thread_name_prefix="webhook",
+        )
+    return _executor
+
+
+def _ordering_key(event):
+    "Events from the same user must run in order; everything else may overlap."
+    source = getattr(event, 'source', None)
+    return (
+        getattr(source, 'user_id', None)
+        or getattr(source, 'group_id', None)
+        or getattr(source, 'room_id', None)
+        or id(event)
+    )
+
+
+class DedupWebhookHandler(WebhookHandler):
+    """
+    WebhookHandler that drops events whose webhookEventId was already
+    handled before dispatching them to the registered handlers. An event
+    whose handler raises is forgotten, so its redelivery runs again.
+    """
+    def __init__(self, channel_secret, dedup=deduplicator):
+        super(DedupWebhookHandler, self).__init__(channel_secret)
+        self.dedup = dedup
+
+    def handler_for(self, event):
+        func = None
+        if isinstance(event, MessageEvent):
+            func = self._handlers.get(f"{event.__class__.__name__}_{event.message.__class__.__name__}")
+        if func is None:
+            func = self._handlers.get(event.__class__.__name__)
+        return func or self._default
+
+    def dispatch(self, event, destination=None):
+        func = self.handler_for(event)
+        if func is None:
+            print(f"No handler for {event.__class__.__name__}")
+            return
+        if func.__code__.co_argcount >= 2:
+            func(event, destination)
+        else:
+            func(event)
+
+    def _run_sequence(self, events, destination, app, received_at):
+        timings = []
+        with app.app_context() if app is not None else nullcontext():
+            for event in events:
+                started = time.perf_counter()
+                error = None
+                try:
+                    self.dispatch(event, destination)
+                except Exception as e:
+                    error = e
+                    self.dedup.release(getattr(event, 'webhook_event_id', None))
+                finished = time.perf_counter()
+                timings.append({
+                    "type": getattr(event, 'type', event.__class__.__name__),
+                    "event_id": getattr(event, 'webhook_event_id', None),
+                    "queued_ms": (started - received_at) * 1000,
+                    "handler_ms": (finished - started) * 1000,
+                    "error": error,
+                })
+        return timings
+
+    def handle(self, body, signature, concurrent=True):
+        """
+        Dispatch a webhook body's events. Events from different users run
+        concurrently on a bounded pool; one user's events keep their order.
+        Returns per-event timings in body order and re-raises the first
+        handler error once every event has run. `concurrent=False` runs everything on the calling
+        thread (e.g. so a profiler sees it).
+        """
+        received_at = time.perf_counter()
+        payload = self.parser.parse(body, signature, as_payload=True)
+        claimed = []
+        sequences = OrderedDict()
+        for event in payload.events:
+            event_id = getattr(event, 'webhook_event_id', None)
+            if not self.dedup.claim(event_id):
+                print(f"Skipping redelivered webhook event {event_id}")
+                continue
+            claimed.append(event)
+            sequences.setdefault(_ordering_key(event), []).append(event)
+
+        app = current_app._get_current_object() if has_app_context() else None
+        if len(sequences) <= 1 or not concurrent:
+            results = [self._run_sequence(events, payload.destination, app, received_at)
+                       for events in sequences.values()]
+        else:
+            futures = [
+                _get_executor().submit(self._run_sequence, events, payload.destination, app, received_at)
+                for events in sequences.values()
+            ]
+            results = [future.result() for future in futures]
+        # Report (and pick the error to raise) in body order, not per user.
+        by_event = {id(event): t for events, sequence in zip(sequences.values(), results)
+                    for event, t in zip(events, sequence)}
+        timings = [by_event[id(event)] for event in claimed]
+
+        for t in timings:
+            status = f" error={t['error']!r}" if t['error'] else ""
+            print(f"webhook event {t['type']} queued {t['queued_ms']:.0f}ms, handled in {t['handler_ms']:.0f}ms{status}")
+        for t in timings:
+            if t['error'] is not None:
+                raise t['error']
+        return timings
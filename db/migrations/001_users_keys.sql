@@ -0,0 +1,7 @@
+-- Drop duplicate registrations (keep the earliest row), then key users on user_id.
+DELETE FROM users a USING users b
+WHERE a.user_id = b.user_id AND a.ctid > b.ctid;
+
+CREATE UNIQUE INDEX IF NOT EXISTS users_user_id_key ON users (user_id);
+
+CREATE INDEX IF NOT EXISTS users_group_id_idx ON users (group_id);
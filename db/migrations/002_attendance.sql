@@ -0,0 +1,15 @@
+-- Check-in ledger. Every submission is one row; the Google Sheet is a
+-- projection of the latest row per (week_start, name).
+CREATE TABLE IF NOT EXISTS attendance (
+    id BIGSERIAL PRIMARY KEY,
+    week_start DATE NOT NULL,
+    name TEXT NOT NULL,
+    state TEXT NOT NULL,
+    recorded_by TEXT,
+    recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    flushed_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS attendance_week_name_idx ON attendance (week_start, name, id DESC);
+
+CREATE INDEX IF NOT EXISTS attendance_unflushed_idx ON attendance (week_start, id) WHERE flushed_at IS NULL;
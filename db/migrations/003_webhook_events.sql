@@ -0,0 +1,7 @@
+-- Webhook event ids we've already handled, shared by every serverless instance.
+CREATE TABLE IF NOT EXISTS webhook_events (
+    event_id TEXT PRIMARY KEY,
+    seen_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS webhook_events_seen_at_idx ON webhook_events (seen_at);
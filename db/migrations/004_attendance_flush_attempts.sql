@@ -0,0 +1,3 @@
+-- Failed sheet flushes per ledger row. Rows stop being retried once they
+-- reach the flusher's attempt limit, and their recorder is notified once.
+ALTER TABLE attendance ADD COLUMN IF NOT EXISTS flush_attempts INTEGER NOT NULL DEFAULT 0;
@@ -0,0 +1,104 @@
+"""
+Benchmark connection reuse against a local stub server.
+
+Sends the same small POST (roughly a LINE reply_message) N times, first with
+a fresh connection per call (what line-bot-sdk's default client does), then
+through the shared pooled session from api.transport, and reports
+requests/sec and how many connections the server accepted. With --tls the
+stub serves HTTPS using a throwaway self-signed cert (needs `openssl`), which
+is where the handshake savings show.
+
+    python scripts/bench_http_transport.py [--tls] [requests]
+"""
+import os
+import ssl
+import sys
+import time
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from api.transport import get_session  # noqa: E402
+
+connections = 0
+_connections_lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate small writes; without TCP_NODELAY
+    # the reused-connection case stalls on delayed ACKs (~40ms per request).
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        global connections
+        with _connections_lock:
+            connections += 1
+        super().setup()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        body = b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _self_signed_cert(directory):
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-addext", "subjectAltName=DNS:localhost",
+         "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    return cert, key
+
+
+def _run(label, post, url, n):
+    global connections
+    connections = 0
+    start = time.perf_counter()
+    for _ in range(n):
+        post(url).raise_for_status()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<24} {n / elapsed:8.0f} req/s  {elapsed / n * 1000:6.2f} ms/req  {connections} connections")
+
+
+def main(argv):
+    tls = "--tls" in argv
+    args = [a for a in argv if a != "--tls"]
+    n = int(args[0]) if args else 200
+    payload = {"replyToken": "x" * 32, "messages": [{"type": "text", "text": "ok"}]}
+
+    server = ThreadingHTTPServer(("localhost", 0), StubHandler)
+    verify = True
+    with tempfile.TemporaryDirectory() as tmp:
+        if tls:
+            cert, key = _self_signed_cert(tmp)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(cert, key)
+            server.socket = context.wrap_socket(server.socket, server_side=True)
+            verify = cert
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"{'https' if tls else 'http'}://localhost:{server.server_address[1]}/v2/bot/message/reply"
+
+        _run("new connection per call", lambda u: requests.post(u, json=payload, verify=verify), url, n)
+        session = get_session()
+        _run("pooled keep-alive", lambda u: session.post(u, json=payload, verify=verify), url, n)
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
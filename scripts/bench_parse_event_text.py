@@ -0,0 +1,209 @@
+"""
+Micro-benchmark for api.gcal.parse_event_text.
+
+Compares the precompiled tokenizer against the original multi-regex
+implementation (kept below verbatim), checks both give identical results on
+a corpus of 規劃 messages, and reports parses/sec.
+
+    python scripts/bench_parse_event_text.py [iterations]
+"""
+import os
+import re
+import sys
+import timeit
+import datetime as dt
+from typing import Optional, Tuple, Dict, Any
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from api.gcal import parse_event_text, _get_timezone, _apply_ampm  # noqa: E402
+
+
+# --- Original implementation, for comparison ---
+def _legacy_extract_date(text: str, now: Optional[dt.datetime]) -> Tuple[Optional[dt.date], Optional[Tuple[int, int, Optional[str]]]]:
+    if now is None:
+        now = dt.datetime.now()
+
+    m = re.search(r"(\d{4})[\-/](\d{1,2})[\-/](\d{1,2})", text)
+    if m:
+        year, month, day = map(int, m.groups())
+        date_obj = dt.date(year, month, day)
+        return date_obj, _legacy_extract_time(text)
+
+    m = re.search(r"(\d{1,2})[\-/](\d{1,2})(?!\d)", text)
+    if m:
+        month, day = map(int, m.groups())
+        year = now.year
+        date_obj = dt.date(year, month, day)
+        return date_obj, _legacy_extract_time(text)
+
+    m = re.search(r"(\d{1,2})\s*月\s*(\d{1,2})\s*日", text)
+    if m:
+        month, day = map(int, m.groups())
+        year = now.year
+        date_obj = dt.date(year, month, day)
+        return date_obj, _legacy_extract_time(text)
+
+    return None, None
+
+
+def _legacy_extract_time(text: str) -> Optional[Tuple[int, int, Optional[str]]]:
+    m = re.search(r"(上午|下午|AM|PM)?\s*(\d{1,2})[:：](\d{2})", text, re.IGNORECASE)
+    if m:
+        ampm = m.group(1)
+        hour = int(m.group(2))
+        minute = int(m.group(3))
+        return hour, minute, ampm
+
+    m = re.search(r"(上午|下午)?\s*(\d{1,2})\s*(?:點|時)\s*(?:(\d{1,2})\s*分?)?", text)
+    if m:
+        ampm = m.group(1)
+        hour = int(m.group(2))
+        minute = int(m.group(3)) if m.group(3) else 0
+        return hour, minute, ampm
+
+    return None
+
+
+
+def legacy_parse_event_text(text: str, timezone_str: str = "Asia/Taipei", now: Optional[dt.datetime] = None) -> Optional[Dict[str, Any]]:
+    if not text or len(text) < 4:
+        return None
+
+    if now is None:
+        now = dt.datetime.now()
+
+    date_obj, time_tuple = _legacy_extract_date(text, now)
+    if not date_obj:
+        return None
+
+    # Extract time range like 900 - 1300 (HHMM-HHMM) if present
+    time_range = _legacy_extract_time_range(text)
+
+    text_clean = re.sub(r"(\d{4})[\-/](\d{1,2})[\-/](\d{1,2})", " ", text)
+    text_clean = re.sub(r"(\d{1,2})[\-/](\d{1,2})(?!\d)", " ", text_clean)
+    text_clean = re.sub(r"(\d{1,2})\s*月\s*(\d{1,2})\s*日", " ", text_clean)
+    text_clean = re.sub(r"(上午|下午|AM|PM)?\s*(\d{1,2})[:：](\d{2})", " ", text_clean, flags=re.IGNORECASE)
+    text_clean = re.sub(r"(上午|下午)?\s*(\d{1,2})\s*(?:點|時)\s*(?:(\d{1,2})\s*分?)?", " ", text_clean)
+    # Remove HHMM - HHMM time range from title text
+    text_clean = re.sub(r"\b(\d{1,2})(\d{2})\s*[-~–—]\s*(\d{1,2})(\d{2})\b", " ", text_clean)
+    title = re.sub(r"\s+", " ", text_clean).strip()
+    if not title:
+        title = "未命名活動"
+
+    tzinfo = _get_timezone(timezone_str)
+
+    # Prefer explicit time range if provided
+    if time_range:
+        sh, sm, eh, em = time_range
+        start_dt = dt.datetime(date_obj.year, date_obj.month, date_obj.day, sh, sm)
+        end_dt = dt.datetime(date_obj.year, date_obj.month, date_obj.day, eh, em)
+        if tzinfo is not None:
+            start_dt = start_dt.replace(tzinfo=tzinfo)
+            end_dt = end_dt.replace(tzinfo=tzinfo)
+        return {
+            "title": title,
+            "all_day": False,
+            "start_dt": start_dt,
+            "end_dt": end_dt,
+            "date": None,
+        }
+
+    if time_tuple:
+        hour, minute, ampm = time_tuple
+        hour = _apply_ampm(hour, ampm)
+        start_dt = dt.datetime(date_obj.year, date_obj.month, date_obj.day, hour, minute)
+        end_dt = start_dt + dt.timedelta(hours=1)
+        if tzinfo is not None:
+            start_dt = start_dt.replace(tzinfo=tzinfo)
+            end_dt = end_dt.replace(tzinfo=tzinfo)
+        return {
+            "title": title,
+            "all_day": False,
+            "start_dt": start_dt,
+            "end_dt": end_dt,
+            "date": None,
+        }
+    else:
+        return {
+            "title": title,
+            "all_day": True,
+            "start_dt": None,
+            "end_dt": None,
+            "date": date_obj,
+        }
+
+
+def _legacy_extract_time_range(text: str) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Extract a time range like '900 - 1300' or '0900-1300'. Returns (start_hour, start_min, end_hour, end_min).
+    """
+    m = re.search(r"\b(\d{1,2})(\d{2})\s*[-~–—]\s*(\d{1,2})(\d{2})\b", text)
+    if not m:
+        return None
+    sh, sm, eh, em = map(int, m.groups())
+    # Validate hour/minute bounds
+    if not (0 <= sh <= 23 and 0 <= eh <= 23 and 0 <= sm <= 59 and 0 <= em <= 59):
+        return None
+    return sh, sm, eh, em
+
+
+# --- Corpus of 規劃 message bodies (text after 『規劃：』) ---
+CORPUS = [
+    "9/10 19:30 小排",
+    "9/10 小排",
+    "2024/9/10 19:30 小排",
+    "2024-12-25 上午10:00 聖誕福音聚會",
+    "12/24 下午7點 報佳音",
+    "12/24 下午7點30分 報佳音",
+    "10月5日 晚上 家聚會",
+    "10月 5 日 14:00 青職聚會",
+    "9/14 900 - 1300 特會服事",
+    "9/14 0900-1300 特會服事",
+    "9/21 1930~2130 禱告聚會",
+    "主日 9/15 10:00",
+    "9-28 9點 晨興",
+    "11/2 PM 2:30 姊妹相調",
+    "11/2 am 9:15 弟兄相調",
+    "11/30 下午 3 點 福音茶會",
+    "1/1 新年特會",
+    "2025/1/1 全天 新年特會",
+    "6/7 18:30 大學生小排 @會所",
+    "8/8 20：00 線上禱告",
+    "3/3 7時 晨禱",
+    "5/20",
+    # Time before date, and HH:MM-HH:MM ranges.
+    "7點 9/10 小排",
+    "晨興 6點 9/2",
+    "下午3點 12月25日 福音",
+    "19:30 9/10 小排",
+    "9/10 19:30-21:00 小排",
+    "10/5 9:00-12:00 特會",
+]
+
+
+def _check_identical(now):
+    for text in CORPUS:
+        old = legacy_parse_event_text(text, now=now)
+        new = parse_event_text(text, now=now)
+        if old != new:
+            raise AssertionError(f"Mismatch for {text!r}:\n  legacy: {old}\n  new:    {new}")
+
+
+def _rate(fn, now, iterations):
+    def run():
+        for text in CORPUS:
+            fn(text, now=now)
+    seconds = timeit.timeit(run, number=iterations)
+    return iterations * len(CORPUS) / seconds
+
+
+if __name__ == "__main__":
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    now = dt.datetime(2024, 9, 1, 12, 0)
+    _check_identical(now)
+    print(f"Identical results on {len(CORPUS)} messages.")
+    before = _rate(legacy_parse_event_text, now, iterations)
+    after = _rate(parse_event_text, now, iterations)
+    print(f"legacy:    {before:,.0f} parses/sec")
+    print(f"tokenizer: {after:,.0f} parses/sec ({after / before:.2f}x)")
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Let `pytest` import the api package from the repo root, as Vercel does.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "test-token")
+os.environ.setdefault("LINE_CHANNEL_SECRET", "test-secret")
+
+from api import index, profiling  # noqa: E402
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", "admin")
+    monkeypatch.setattr(index, "CRON_SECRET", "cron")
+    monkeypatch.setattr(index, "flush_to_sheet", lambda: {"楊光宇": True})
+    return index.app.test_client()
+
+
+@pytest.mark.parametrize("path", ["/metrics", "/api/command-stats", "/api/google-stats"])
+def test_stats_endpoints_need_the_admin_token(client, path):
+    assert client.get(path).status_code == 404
+    assert client.get(path, headers={"Authorization": "Bearer cron"}).status_code == 404
+    assert client.get(path, headers={"Authorization": "Bearer admin"}).status_code == 200
+
+
+def test_flush_accepts_the_cron_secret_or_admin_token(client):
+    assert client.get("/api/flush").status_code == 404
+    assert client.get("/api/flush", headers={"Authorization": "Bearer wrong"}).status_code == 404
+    response = client.get("/api/flush", headers={"Authorization": "Bearer cron"})
+    assert response.status_code == 200
+    assert response.get_json()["flushed"] == ["楊光宇"]
+    assert client.get("/api/flush", headers={"Authorization": "Bearer admin"}).status_code == 200
+
+
+def test_flush_is_closed_when_no_secret_is_configured(client, monkeypatch):
+    monkeypatch.setattr(profiling, "ADMIN_TOKEN", "")
+    monkeypatch.setattr(index, "CRON_SECRET", "")
+    assert client.get("/api/flush", headers={"Authorization": "Bearer "}).status_code == 404
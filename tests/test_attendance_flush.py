@@ -0,0 +1,86 @@
+import datetime as dt
+from contextlib import contextmanager
+
+import pytest
+
+from api import attendance, gsheet
+
+LAST_WEEK = dt.date(2026, 10, 5)
+THIS_WEEK = dt.date(2026, 10, 12)
+
+
+@pytest.fixture(autouse=True)
+def unlocked_weeks(monkeypatch):
+    held = set()
+
+    @contextmanager
+    def lock(week):
+        yield week not in held
+
+    monkeypatch.setattr(attendance, "attendance_flush_lock", lock)
+    return held
+
+
+def test_flushes_every_unflushed_week_and_notifies_exhausted_rows(monkeypatch):
+    ledger = {
+        LAST_WEEK: ({"楊光宇": "CD", "張筱翊": "E"}, 10),
+        THIS_WEEK: ({"楊光宇": "C"}, 12),
+    }
+    writes, flushed, failures, notified = [], [], [], []
+    monkeypatch.setattr(attendance, "fetch_unflushed_weeks", lambda max_attempts: sorted(ledger))
+    monkeypatch.setattr(attendance, "fetch_unflushed_attendance", lambda week, max_attempts: ledger[week])
+    monkeypatch.setattr(attendance, "mark_attendance_flushed", lambda week, names, max_id: flushed.append((week, names)))
+
+    def record_failure(week, names, max_id, max_attempts):
+        failures.append((week, names))
+        return {"U2": names}
+
+    monkeypatch.setattr(attendance, "record_flush_failure", record_failure)
+    monkeypatch.setattr(
+        gsheet, "update_gsheet_checkboxes",
+        lambda states: writes.append(states) or {name: name != "張筱翊" for name in states},
+    )
+    monkeypatch.setattr(attendance, "_failure_handlers", [notified.append])
+
+    results = attendance.flush_to_sheet()
+
+    assert writes == [{"楊光宇": "CD", "張筱翊": "E"}, {"楊光宇": "C"}]
+    assert flushed == [(LAST_WEEK, ["楊光宇"]), (THIS_WEEK, ["楊光宇"])]
+    assert failures == [(LAST_WEEK, ["張筱翊"])]
+    assert notified == [{"U2": ["張筱翊"]}]
+    assert results == {"楊光宇": True, "張筱翊": False}
+
+
+def test_failed_flush_is_retried_from_a_timer_with_backoff(monkeypatch):
+    delays, outcomes = [], iter([{"楊光宇": False}, {"楊光宇": False}, {"楊光宇": True}])
+
+    class ImmediateTimer:
+        def __init__(self, delay, fn, args):
+            self.delay, self.fn, self.args = delay, fn, args
+
+        def start(self):
+            delays.append(self.delay)
+            self.fn(*self.args)
+
+    monkeypatch.setattr(attendance, "fetch_unflushed_weeks", lambda max_attempts: [THIS_WEEK])
+    monkeypatch.setattr(attendance, "_flush_week", lambda week: next(outcomes))
+    monkeypatch.setattr(attendance, "FLUSH_RETRY_DELAY", 2.0)
+    monkeypatch.setattr(attendance.threading, "Timer", ImmediateTimer)
+    monkeypatch.setattr(attendance.deferred, "submit", lambda fn, *args: fn(*args))
+
+    attendance._run_flush(None)
+
+    assert delays == [2.0, 4.0]
+
+
+def test_week_locked_elsewhere_is_skipped_and_retried(monkeypatch, unlocked_weeks):
+    unlocked_weeks.add(LAST_WEEK)
+    flushed, retries = [], []
+    monkeypatch.setattr(attendance, "fetch_unflushed_weeks", lambda max_attempts: [LAST_WEEK, THIS_WEEK])
+    monkeypatch.setattr(attendance, "_flush_week", lambda week: flushed.append(week) or {"楊光宇": True})
+    monkeypatch.setattr(attendance, "_retry_later", lambda app, attempt: retries.append(attempt))
+
+    attendance._run_flush(None)
+
+    assert flushed == [THIS_WEEK]
+    assert retries == [1]
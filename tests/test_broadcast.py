@@ -0,0 +1,25 @@
+import requests
+
+from api.broadcast import broadcast
+
+
+class FlakyLineApi:
+    def __init__(self, failing_chunk):
+        self.failing_chunk = failing_chunk
+        self.sent = []
+
+    def multicast(self, user_ids, messages):
+        if user_ids == self.failing_chunk:
+            raise requests.exceptions.ConnectionError("connection reset")
+        self.sent.append(user_ids)
+
+
+def test_network_error_fails_only_its_chunk():
+    chunks = [["U1", "U2"], ["U3"], ["U4", "U5"]]
+    api = FlakyLineApi(failing_chunk=["U3"])
+    summary = broadcast(api, iter(chunks), [], max_workers=2, rate=1000)
+    assert summary["chunks"] == 3
+    assert summary["delivered"] == 4
+    assert summary["failed"] == 1
+    assert len(summary["errors"]) == 1
+    assert sorted(api.sent) == [["U1", "U2"], ["U4", "U5"]]
@@ -0,0 +1,123 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "test-token")
+os.environ.setdefault("LINE_CHANNEL_SECRET", "test-secret")
+
+from api import gsheet  # noqa: E402
+from api import index  # noqa: E402
+
+
+class FakeSheet:
+    def __init__(self, names, rows):
+        self.names = names
+        self.rows = rows
+
+    def col_values(self, column):
+        return self.names
+
+    def batch_get(self, ranges, value_render_option=None):
+        return [self.rows]
+
+
+@pytest.fixture
+def sheet(monkeypatch):
+    # Row 2 has 主日 (C) and the card-less column L ticked.
+    fake = FakeSheet(["名字", "楊光宇"], [["主日"], [True, False] + [False] * 7 + [True]])
+    monkeypatch.setattr(gsheet, "_with_sheet", lambda read: read(fake))
+    monkeypatch.setattr(gsheet, "name_index", gsheet.NameIndex())
+    monkeypatch.setattr(gsheet.name_index, "_spreadsheet_version", lambda: "v1")
+    monkeypatch.setattr(gsheet, "sheet_snapshot", gsheet.SheetSnapshot())
+    return fake
+
+
+@pytest.fixture
+def queued(monkeypatch):
+    jobs = []
+    monkeypatch.setattr(gsheet.deferred, "submit", lambda fn, *args, **kwargs: jobs.append((fn, args)))
+    monkeypatch.setattr(gsheet, "_refresh_scheduled", False)
+    return jobs
+
+
+@pytest.fixture
+def unflushed(monkeypatch):
+    names = set()
+    monkeypatch.setattr(index, "unflushed_names", lambda candidates: names & set(candidates))
+    return names
+
+
+@pytest.fixture
+def line(monkeypatch):
+    replies = []
+    monkeypatch.setattr(index.line_bot_api, "reply_message", lambda token, message: replies.append(message))
+    monkeypatch.setattr(index.profile_cache, "get_display_name", lambda user_id: "楊光宇")
+    return replies
+
+
+def test_cold_snapshot_is_refreshed_in_background_not_inline(sheet, queued, monkeypatch):
+    def no_inline_read(read):
+        raise AssertionError("the sheet must not be read before the reply")
+
+    monkeypatch.setattr(gsheet, "_with_sheet", no_inline_read)
+    assert gsheet.current_state_for("楊光宇", "U1") is None
+    assert gsheet.current_state_for("楊光宇", "U1") is None
+    assert len(queued) == 1
+
+    monkeypatch.setattr(gsheet, "_with_sheet", lambda read: read(sheet))
+    fn, args = queued[0]
+    fn(*args)
+    assert gsheet.current_state_for("楊光宇", "U1") == "CL"
+
+
+def test_card_prefill_leaves_out_events_without_buttons(sheet, queued, line, monkeypatch):
+    gsheet._refresh_sheet_caches(None)
+    cards = []
+    monkeypatch.setattr(index, "create_all_counter_message", lambda *args, **kwargs: cards.append(kwargs))
+    event = SimpleNamespace(reply_token="r", source=SimpleNamespace(user_id="U1"))
+
+    index.handle_checkin_command(event, None)
+
+    assert cards[0]["state"] == "C"
+
+
+def test_submitting_a_state_with_column_l_still_replies(sheet, queued, line, monkeypatch):
+    gsheet._refresh_sheet_caches(None)
+    recorded = []
+    monkeypatch.setattr(index, "record_checkin", lambda states, user_id: recorded.append(states))
+    event = SimpleNamespace(reply_token="r", source=SimpleNamespace(user_id="U1"))
+
+    with index.app.app_context():
+        index.handle_gsheet_record(event, {"state": "CDL", "rels": ""}, "U1", None)
+
+    assert recorded == [{"楊光宇": "CDL"}]
+    assert "主日聚會, 禱告聚會" in line[0].text
+
+
+def test_unchanged_check_in_skips_writes(sheet, queued, line, unflushed, monkeypatch):
+    gsheet._refresh_sheet_caches(None)
+    recorded = []
+    monkeypatch.setattr(index, "record_checkin", lambda states, user_id: recorded.append(states))
+    event = SimpleNamespace(reply_token="r", source=SimpleNamespace(user_id="U1"))
+
+    with index.app.app_context():
+        index.handle_gsheet_record(event, {"state": "LC", "rels": ""}, "U1", None)
+
+    assert recorded == []
+    assert len(line) == 1
+
+
+def test_check_in_matching_the_snapshot_is_written_while_rows_are_unflushed(sheet, queued, line, unflushed, monkeypatch):
+    # The snapshot reads CL, but an earlier ledger row for the name hasn't
+    # reached the sheet; skipping now would let that row's state win.
+    gsheet._refresh_sheet_caches(None)
+    unflushed.add("楊光宇")
+    recorded = []
+    monkeypatch.setattr(index, "record_checkin", lambda states, user_id: recorded.append(states))
+    event = SimpleNamespace(reply_token="r", source=SimpleNamespace(user_id="U1"))
+
+    with index.app.app_context():
+        index.handle_gsheet_record(event, {"state": "LC", "rels": ""}, "U1", None)
+
+    assert recorded == [{"楊光宇": "LC"}]
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "test-token")
+os.environ.setdefault("LINE_CHANNEL_SECRET", "test-secret")
+
+from api import index  # noqa: E402
+from api.commands import CommandRegistry  # noqa: E402
+
+
+@pytest.fixture
+def registry():
+    registry = CommandRegistry()
+    calls = []
+
+    @registry.command("點名", scopes=("user",))
+    def checkin(event, cmd):
+        calls.append(cmd)
+
+    @registry.command("活動列表", takes_args=True)
+    def list_events(event, cmd):
+        calls.append(cmd)
+
+    @registry.command(prefixes=("規劃：", "規劃:"), scopes=("group",))
+    def plan(event, cmd):
+        calls.append(cmd)
+
+    registry.calls = calls
+    return registry
+
+
+def test_exact_words_and_both_plan_prefixes_resolve(registry):
+    assert registry.resolve("點名", "user")[0].name == "checkin"
+    assert registry.resolve("點名 ", "user") == (None, None)
+    for text in ("規劃：9/10 19:30 小排", "規劃:9/10 19:30 小排", " 規劃： 9/10 19:30 小排"):
+        cmd, args = registry.resolve(text, "group")
+        assert (cmd.name, args) == ("plan", "9/10 19:30 小排")
+
+
+def test_commands_outside_their_scope_do_not_match(registry):
+    assert registry.resolve("點名", "group") == (None, None)
+    assert registry.resolve("規劃：9/10 小排", "user") == (None, None)
+    assert registry.dispatch(None, "點名", "group") is False
+    assert registry.calls == []
+
+
+def test_arguments_only_follow_a_space_on_commands_that_take_them(registry):
+    cmd, args = registry.resolve("活動列表 7", "group")
+    assert (cmd.name, args) == ("list_events", "7")
+    assert registry.resolve("活動列表", "user")[1] == ""
+    assert registry.resolve("活動列表abc", "group") == (None, None)
+    assert registry.resolve("點名 楊光宇", "user") == (None, None)
+
+
+def test_registering_a_word_or_prefix_twice_fails(registry):
+    with pytest.raises(ValueError):
+        registry.command("點名")(lambda event, cmd: None)
+    with pytest.raises(ValueError):
+        registry.command(prefixes=("規劃:",))(lambda event, cmd: None)
+
+
+def test_dispatch_passes_the_call_and_records_stats(registry):
+    assert registry.dispatch("event", "活動列表 7", "user") is True
+    assert registry.dispatch("event", "活動列表 14", "user") is True
+
+    assert [(c.name, c.text, c.args, c.scope) for c in registry.calls] == [
+        ("list_events", "活動列表 7", "7", "user"),
+        ("list_events", "活動列表 14", "14", "user"),
+    ]
+    stats = registry.stats["list_events"]
+    assert stats["count"] == 2
+    assert 0 <= stats["max_ms"] <= stats["total_ms"]
+
+
+def test_stats_are_recorded_when_a_handler_raises(registry):
+    @registry.command("壞掉")
+    def broken(event, cmd):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        registry.dispatch(None, "壞掉", "user")
+    assert registry.stats["broken"]["count"] == 1
+
+
+def test_app_registers_the_expected_commands():
+    assert index.commands.resolve("規劃:9/10 小排", "group")[0].name == "handle_plan_calendar_in_group"
+    assert index.commands.resolve("點名", "group") == (None, None)
+    assert index.commands.resolve("活動列表 7", "user")[1] == "7"
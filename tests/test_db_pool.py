@@ -0,0 +1,78 @@
+from api.db import ConnectionPool, User
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, sql, params=None, **kwargs):
+        # Like pg8000.dbapi: every statement runs inside a transaction.
+        self.conn.in_transaction = True
+        self.last = sql
+
+    def fetchall(self):
+        return [("U1",)] if self.last.startswith("FETCH") else []
+
+
+class FakeConnection:
+    in_transaction = False
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.in_transaction = False
+
+    def rollback(self):
+        self.in_transaction = False
+
+    def close(self):
+        pass
+
+
+def test_closing_a_streaming_generator_releases_its_connection():
+    pool = ConnectionPool(connect=FakeConnection, max_size=2, acquire_timeout=0.1)
+    user = User(None, None, None, pool=pool)
+    for _ in range(3):
+        chunks = user.iter_user_id_chunks()
+        assert next(chunks) == ["U1"]
+        chunks.close()
+    with pool.connection():
+        pass
+
+
+def test_error_rolls_back_and_releases():
+    pool = ConnectionPool(connect=FakeConnection, max_size=1, acquire_timeout=0.1)
+    for _ in range(2):
+        try:
+            with pool.connection():
+                raise ValueError("boom")
+        except ValueError:
+            pass
+    assert len(pool._idle) == 1
+
+
+def test_query_span_times_statements_only():
+    from api.metrics import outbound_call_seconds
+
+    def query_count():
+        return sum(
+            series[-2] for key, series in outbound_call_seconds._series.items()
+            if dict(key).get("op") == "query"
+        )
+
+    pool = ConnectionPool(connect=FakeConnection, max_size=1)
+    before = query_count()
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.execute("SELECT 2")
+    assert query_count() - before == 2
+
+
+def test_read_only_borrow_leaves_no_open_transaction():
+    pool = ConnectionPool(connect=FakeConnection, max_size=1)
+    with pool.connection() as conn:
+        conn.cursor().execute("SELECT name FROM users")
+    idle_conn, _ = pool._idle[0]
+    assert not idle_conn.in_transaction
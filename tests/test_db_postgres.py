@@ -0,0 +1,92 @@
+"""
+Runs against a real, throwaway PostgreSQL database when TEST_POSTGRES_SOCKET
+points at its unix socket (e.g. /tmp/pgdata/.s.PGSQL.5432); skipped otherwise.
+"""
+import os
+import datetime as dt
+import uuid
+
+import pg8000.dbapi
+import pytest
+
+from api import db
+
+SOCKET = os.getenv("TEST_POSTGRES_SOCKET")
+pytestmark = pytest.mark.skipif(not SOCKET, reason="TEST_POSTGRES_SOCKET is not set")
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _connect(database):
+    return pg8000.dbapi.connect(
+        user=os.getenv("TEST_POSTGRES_USER", "postgres"), unix_sock=SOCKET, database=database
+    )
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    name = f"grace_test_{uuid.uuid4().hex[:8]}"
+    admin = _connect("postgres")
+    admin.autocommit = True
+    admin.cursor().execute(f"CREATE DATABASE {name}")
+    monkeypatch.chdir(REPO_ROOT)
+    conn = _connect(name)
+    db.migrate(conn)
+    conn.close()
+    pool = db.ConnectionPool(connect=lambda: _connect(name), max_size=2)
+    yield pool
+    pool.close()
+    admin.cursor().execute(f"DROP DATABASE {name} WITH (FORCE)")
+    admin.close()
+
+
+def test_users_have_a_single_unique_index(pool):
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'users' AND indexdef LIKE 'CREATE UNIQUE%%'"
+        )
+        assert [row[0] for row in cursor.fetchall()] == ["users_user_id_key"]
+
+
+def test_add_user_upserts_with_a_reused_prepared_statement(pool):
+    assert db.User("U1", None, "甲", pool=pool).add_user() is True
+    assert db.User("U1", None, "甲", pool=pool).add_user() is False
+    assert db.User("U2", "G1", "乙", pool=pool).add_user() is True
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT count(*) FROM pg_prepared_statements")
+        assert cursor.fetchall()[0][0] == 1
+        cursor.execute("SELECT user_id FROM users ORDER BY user_id")
+        assert [row[0] for row in cursor.fetchall()] == ["U1", "U2"]
+
+
+def test_read_only_borrow_is_not_left_idle_in_transaction(pool):
+    assert db.User("U9", None, None, pool=pool).fetch_name() is None
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT count(*) FROM pg_stat_activity "
+            "WHERE datname = current_database() AND state = 'idle in transaction' AND pid <> pg_backend_pid()"
+        )
+        assert cursor.fetchall()[0][0] == 0
+
+
+def test_attendance_flush_lock_admits_one_holder_per_week(pool):
+    week = dt.date(2026, 10, 12)
+    with db.attendance_flush_lock(week, pool=pool) as first:
+        with db.attendance_flush_lock(week, pool=pool) as second:
+            assert (first, second) == (True, False)
+        with db.attendance_flush_lock(week + dt.timedelta(days=7), pool=pool) as other_week:
+            assert other_week is True
+    with db.attendance_flush_lock(week, pool=pool) as again:
+        assert again is True
+
+
+def test_unflushed_names_only_reports_rows_not_yet_in_the_sheet(pool):
+    week = dt.date(2026, 10, 12)
+    db.record_attendance(week, {"甲": "C", "乙": "D"}, "U1", pool=pool)
+    states, max_id = db.fetch_unflushed_attendance(week, 3, pool=pool)
+    db.mark_attendance_flushed(week, ["甲"], max_id, pool=pool)
+    assert db.fetch_unflushed_names(week, ["甲", "乙", "丙"], pool=pool) == {"乙"}
+    assert db.fetch_unflushed_names(week - dt.timedelta(days=7), ["乙"], pool=pool) == set()
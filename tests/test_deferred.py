@@ -0,0 +1,24 @@
+import threading
+
+from api.deferred import DeferredQueue
+
+
+def test_drain_timeout_leaves_no_thread_behind():
+    release = threading.Event()
+    queue = DeferredQueue()
+    queue.submit(release.wait)
+    before = threading.active_count()
+    for _ in range(5):
+        assert queue.drain(0.01) is False
+    assert threading.active_count() == before
+    release.set()
+    assert queue.drain(1) is True
+
+
+def test_drain_waits_for_queued_jobs():
+    done = []
+    queue = DeferredQueue()
+    for i in range(3):
+        queue.submit(done.append, i)
+    assert queue.drain(1) is True
+    assert done == [0, 1, 2]
@@ -0,0 +1,38 @@
+import json
+
+import httplib2
+import pytest
+import requests
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from api import gcal
+
+
+@pytest.fixture
+def service_account(monkeypatch):
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    ).decode()
+    monkeypatch.setenv("SERVICE_ACC_SECRET", json.dumps({
+        "type": "service_account",
+        "client_email": "bot@example.iam.gserviceaccount.com",
+        "private_key": pem,
+        "private_key_id": "test",
+        "token_uri": "https://oauth2.googleapis.com/token",
+    }))
+    monkeypatch.delenv("CALENDAR_DISCOVERY_DOC", raising=False)
+
+
+def test_build_calendar_service_makes_no_discovery_request(service_account, monkeypatch):
+    def no_network(*args, **kwargs):
+        raise AssertionError("unexpected HTTP request while building the Calendar service")
+
+    monkeypatch.setattr(httplib2.Http, "request", no_network)
+    monkeypatch.setattr(requests.Session, "request", no_network)
+
+    service = gcal._build_calendar_service()
+    assert hasattr(service, "events")
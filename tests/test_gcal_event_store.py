@@ -0,0 +1,25 @@
+from api import gcal
+
+
+def test_cold_store_answers_from_bounded_query_and_syncs_in_background(monkeypatch):
+    queued = []
+    store = gcal.EventStore("cal")
+    monkeypatch.setattr(gcal, "get_event_store", lambda calendar_id=None: store)
+    monkeypatch.setattr(gcal.deferred, "submit", lambda fn, *args, **kwargs: queued.append(fn))
+    monkeypatch.setattr(gcal, "list_events_next_days", lambda days, calendar_id: iter([{"summary": "小排"}] * 3))
+
+    assert gcal.list_upcoming_events(days=7, limit=2) == [{"summary": "小排"}] * 2
+    gcal.list_upcoming_events(days=7)
+    assert len(queued) == 1
+
+    fetched = []
+
+    def fake_fetch(**params):
+        fetched.append(params)
+        return [], "token"
+
+    monkeypatch.setattr(store, "_fetch", fake_fetch)
+    queued[0]()
+    assert store.is_warm()
+    assert "timeMin" in fetched[0]
+    assert gcal.list_upcoming_events(days=7) == []
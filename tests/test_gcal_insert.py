@@ -0,0 +1,69 @@
+import datetime as dt
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from api import gcal
+
+
+def _http_error(status):
+    return HttpError(httplib2.Response({"status": status}), b"{}")
+
+
+class FakeRequest:
+    def __init__(self, run):
+        self.run = run
+
+    def execute(self, http=None):
+        return self.run()
+
+
+class FakeEvents:
+    "Creates the event on the first insert but loses the response, like a dropped connection."
+
+    def __init__(self):
+        self.created = {}
+        self.inserted_ids = []
+
+    def insert(self, calendarId, body):
+        def run():
+            self.inserted_ids.append(body["id"])
+            if body["id"] in self.created:
+                raise _http_error(409)
+            self.created[body["id"]] = dict(body, htmlLink="https://calendar/" + body["id"])
+            raise _http_error(503)
+        return FakeRequest(run)
+
+    def get(self, calendarId, eventId):
+        return FakeRequest(lambda: self.created[eventId])
+
+
+class FakeService:
+    def __init__(self):
+        self.fake_events = FakeEvents()
+
+    def events(self):
+        return self.fake_events
+
+
+def test_retried_insert_returns_the_event_it_created(monkeypatch):
+    service = FakeService()
+    monkeypatch.setattr(gcal, "get_calendar_service", lambda: service)
+    monkeypatch.setattr(gcal, "authorized_http", lambda credentials: None)
+    monkeypatch.setattr("api.resilience.time.sleep", lambda seconds: None)
+
+    created = gcal.create_calendar_event(
+        "小排", calendar_id="cal", date=dt.date(2026, 10, 20), event_key="webhook-1",
+    )
+
+    ids = service.fake_events.inserted_ids
+    assert len(ids) == 2 and ids[0] == ids[1]
+    assert list(service.fake_events.created) == [created["id"]]
+    assert created["htmlLink"].endswith(created["id"])
+
+
+def test_event_ids_are_stable_base32hex():
+    event_id = gcal._event_id("cal:webhook-1")
+    assert event_id == gcal._event_id("cal:webhook-1") != gcal._event_id("cal:webhook-2")
+    assert 5 <= len(event_id) <= 1024
+    assert set(event_id) <= set("0123456789abcdefghijklmnopqrstuv")
@@ -0,0 +1,29 @@
+from api import gsheet
+
+
+def make_index(monkeypatch, names, name_for_user=None):
+    reads = []
+
+    def read_column(write):
+        reads.append(1)
+        return write(type("Sheet", (), {"col_values": lambda self, col: names})())
+
+    monkeypatch.setattr(gsheet, "_with_sheet", read_column)
+    index = gsheet.NameIndex(name_for_user=name_for_user)
+    monkeypatch.setattr(index, "_spreadsheet_version", lambda: "v1")
+    return index, reads
+
+
+def test_row_for_user_uses_known_name_and_caches_by_user_id(monkeypatch):
+    def no_db(user_id):
+        raise AssertionError("users table should not be queried when the name is known")
+
+    index, reads = make_index(monkeypatch, ["名字", "楊光宇", "張筱翊"], name_for_user=no_db)
+    assert index.row_for_user("U1", "張筱翊") == "3"
+    assert index.row_for_user("U1") == "3"
+    assert len(reads) == 1
+
+
+def test_row_for_user_falls_back_to_stored_name(monkeypatch):
+    index, _ = make_index(monkeypatch, ["名字", "楊光宇"], name_for_user=lambda user_id: "楊光宇")
+    assert index.row_for_user("U2") == "2"
@@ -0,0 +1,48 @@
+import os
+import random
+import datetime as dt
+import importlib.util
+
+import pytest
+
+from api.gcal import parse_event_text
+
+_BENCH = os.path.join(os.path.dirname(__file__), "..", "scripts", "bench_parse_event_text.py")
+_spec = importlib.util.spec_from_file_location("bench_parse_event_text", _BENCH)
+bench = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bench)
+
+NOW = dt.datetime(2024, 9, 1, 12, 0)
+
+TOKENS = [
+    "9/10", "12/25", "2024/9/10", "2025-1-3", "9-28", "10月5日", "12 月 25 日",
+    "19:30", "7:05", "20：00", "PM 2:30", "am 9:15", "下午3點", "上午10點30分", "7點", "6時",
+    "900 - 1300", "0900-1300", "1930~2130", "19:30-21:00",
+    "小排", "晨興", "福音", "主日", "@會所", "3", "12", "/", "-", "點",
+]
+
+
+def _outcome(fn, text):
+    try:
+        return fn(text, now=NOW)
+    except ValueError as e:
+        return type(e)
+
+
+@pytest.mark.parametrize("text", bench.CORPUS)
+def test_matches_legacy_parser_on_corpus(text):
+    assert _outcome(parse_event_text, text) == _outcome(bench.legacy_parse_event_text, text)
+
+
+def test_matches_legacy_parser_on_random_token_mixes():
+    rng = random.Random(1234)
+    for _ in range(5000):
+        parts = rng.choices(TOKENS, k=rng.randint(1, 5))
+        text = rng.choice(["", " "]).join(parts)
+        assert _outcome(parse_event_text, text) == _outcome(bench.legacy_parse_event_text, text), text
+
+
+def test_time_before_date():
+    parsed = parse_event_text("7點 9/10 小排", now=NOW)
+    assert parsed["title"] == "小排"
+    assert parsed["start_dt"].month == 9 and parsed["start_dt"].day == 10
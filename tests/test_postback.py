@@ -0,0 +1,63 @@
+import pytest
+
+from api.postback import decode_postback, encode_postback, normalize_state, toggle_event
+
+FAMILY = ["楊光宇", "楊歆悅", "楊依璨", "蔡紋綺"]
+
+# LINE rejects postback actions whose data is longer than this.
+LINE_POSTBACK_DATA_LIMIT = 300
+
+
+def test_round_trip_with_selected_members_and_target():
+    data = encode_postback("n", "KCE", FAMILY, selected=["楊光宇", "蔡紋綺"], target="楊依璨")
+    assert decode_postback(data, FAMILY) == {
+        "action": "n",
+        "state": "CEK",
+        "rels": "楊光宇,蔡紋綺",
+        "target": "楊依璨",
+    }
+
+
+def test_round_trip_without_target_or_members():
+    data = encode_postback("s", "", [], selected=[])
+    assert decode_postback(data, []) == {"action": "s", "state": "", "rels": ""}
+
+
+def test_legacy_payload_is_normalized():
+    result = decode_postback("action:n&state:DCDC&rels:楊光宇,楊歆悅", FAMILY)
+    assert result == {"action": "n", "state": "CD", "rels": "楊光宇,楊歆悅"}
+
+
+def test_legacy_payload_ignores_junk_pairs():
+    assert decode_postback("action:r&&noseparator&state:E", FAMILY) == {"action": "r", "state": "E"}
+
+
+@pytest.mark.parametrize("data", [
+    "2|n|5|3",          # too few fields
+    "2|n|5|3|1|9",      # too many fields
+    "2|n|zz|3|1",       # bad event hex
+    "2|n|5|xyz|1",      # bad member hex
+    "2|n||3|1",         # empty event mask
+])
+def test_malformed_v2_payloads_decode_to_nothing(data):
+    assert decode_postback(data, FAMILY) == {}
+
+
+@pytest.mark.parametrize("target", ["9", "-1", "a"])
+def test_out_of_range_target_is_dropped(target):
+    result = decode_postback(f"2|r|1|1|{target}", FAMILY)
+    assert "target" not in result
+    assert result["rels"] == "楊光宇"
+
+
+def test_large_family_payload_fits_line_limit():
+    family = [f"成員{i:02d} 很長很長的顯示名稱" for i in range(40)]
+    data = encode_postback("r", "CDEFGHIJKL", family, selected=family, target=family[-1])
+    assert len(data) <= LINE_POSTBACK_DATA_LIMIT
+    assert decode_postback(data, family)["rels"].split(",") == family
+
+
+def test_toggle_event_and_normalize():
+    assert toggle_event("CD", "D") == "C"
+    assert toggle_event("C", "K") == "CK"
+    assert normalize_state("LKC") == "CKL"
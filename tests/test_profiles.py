@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+
+import pytest
+
+from api.profiles import ProfileCache
+
+
+def make_cache(line_name, stored_name, line_fails=False):
+    line_calls, stored, queued = [], [], []
+
+    def fetch_profile(user_id):
+        line_calls.append(user_id)
+        if line_fails:
+            raise RuntimeError("LINE down")
+        return SimpleNamespace(display_name=line_name)
+
+    cache = ProfileCache(
+        fetch_profile,
+        secondary=lambda user_id: stored_name,
+        on_changed=lambda user_id, name: stored.append((user_id, name)),
+        schedule=lambda fn, *args: queued.append((fn, args)),
+    )
+    return cache, line_calls, stored, queued
+
+
+def test_stored_name_is_served_without_waiting_for_line():
+    cache, line_calls, stored, queued = make_cache("New Name", "Old Name")
+    assert cache.get_display_name("U1") == "Old Name"
+    assert line_calls == []
+    assert len(queued) == 1
+
+
+def test_background_revalidation_picks_up_a_renamed_user():
+    cache, line_calls, stored, queued = make_cache("New Name", "Old Name")
+    cache.get_display_name("U1")
+    fn, args = queued[0]
+    fn(*args)
+    assert stored == [("U1", "New Name")]
+    assert cache.get_display_name("U1") == "New Name"
+
+
+def test_unchanged_name_is_not_written_back():
+    cache, line_calls, stored, queued = make_cache("Same", "Same")
+    cache.get_display_name("U1")
+    fn, args = queued[0]
+    fn(*args)
+    assert stored == []
+
+
+def test_unknown_user_goes_to_line_and_failures_are_negatively_cached():
+    cache, line_calls, stored, queued = make_cache("Name", None)
+    assert cache.get_display_name("U1") == "Name"
+    assert queued == []
+
+    cache, line_calls, stored, queued = make_cache(None, None, line_fails=True)
+    with pytest.raises(RuntimeError):
+        cache.get_display_name("U1")
+    with pytest.raises(LookupError):
+        cache.get_display_name("U1")
+    assert line_calls == ["U1"]
@@ -0,0 +1,39 @@
+import httplib2
+import pytest
+import requests
+from google.auth.exceptions import TransportError
+
+from api.resilience import GoogleCallGuard, is_retryable
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.ConnectionError("reset"),
+    requests.exceptions.ReadTimeout("slow"),
+    httplib2.ServerNotFoundError("dns"),
+    TransportError("token refresh"),
+    ConnectionResetError(),
+])
+def test_network_errors_are_retryable(error):
+    assert is_retryable(error)
+
+
+def test_client_errors_are_not_retryable():
+    response = requests.Response()
+    response.status_code = 400
+    assert not is_retryable(requests.exceptions.HTTPError(response=response))
+    assert not is_retryable(ValueError("bad input"))
+
+
+def test_requests_errors_are_retried_and_open_the_circuit(monkeypatch):
+    monkeypatch.setattr("api.resilience.time.sleep", lambda seconds: None)
+    guard = GoogleCallGuard("test", per_minute=6000, max_retries=2, failure_threshold=1)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        raise requests.exceptions.ConnectionError("reset")
+
+    with pytest.raises(requests.exceptions.ConnectionError):
+        guard.call(flaky)
+    assert len(calls) == 3
+    assert guard.snapshot()["state"] == "open"
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+import pytest
+
+from api.dedup import WebhookDeduplicator
+from api.webhook import DedupWebhookHandler
+
+
+class FakeParser:
+    def __init__(self, events):
+        self.events = events
+
+    def parse(self, body, signature, as_payload=False):
+        return SimpleNamespace(events=self.events, destination=None)
+
+
+def make_handler(fail_times):
+    handler = DedupWebhookHandler("secret", dedup=WebhookDeduplicator())
+    event = SimpleNamespace(type="postback", webhook_event_id="E1", source=SimpleNamespace(user_id="U1"))
+    handler.parser = FakeParser([event])
+    calls = []
+
+    def on_event(event):
+        calls.append(event)
+        if len(calls) <= fail_times:
+            raise RuntimeError("sheet down")
+
+    handler._default = on_event
+    return handler, calls
+
+
+def test_failed_event_is_handled_again_on_redelivery():
+    handler, calls = make_handler(fail_times=1)
+    with pytest.raises(RuntimeError):
+        handler.handle("body", "sig")
+    handler.handle("body", "sig")
+    assert len(calls) == 2
+
+
+def test_successful_event_is_not_handled_twice():
+    handler, calls = make_handler(fail_times=0)
+    handler.handle("body", "sig")
+    handler.handle("body", "sig")
+    assert len(calls) == 1
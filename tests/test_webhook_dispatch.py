@@ -0,0 +1,81 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from api.dedup import WebhookDeduplicator
+from api.webhook import DedupWebhookHandler
+
+
+class FakeParser:
+    def __init__(self, events):
+        self.events = events
+
+    def parse(self, body, signature, as_payload=False):
+        return SimpleNamespace(events=self.events, destination=None)
+
+
+def make_event(event_id, user_id):
+    return SimpleNamespace(type="message", webhook_event_id=event_id, source=SimpleNamespace(user_id=user_id))
+
+
+def make_handler(events, on_event):
+    handler = DedupWebhookHandler("secret", dedup=WebhookDeduplicator())
+    handler.parser = FakeParser(events)
+    handler._default = on_event
+    return handler
+
+
+def test_one_users_events_run_in_order_while_users_overlap():
+    # U1's first event waits until U2's has started, which can only happen
+    # if the two users run at the same time.
+    u2_started = threading.Event()
+    handled, lock = [], threading.Lock()
+
+    def on_event(event):
+        if event.webhook_event_id == "U1-a":
+            assert u2_started.wait(timeout=5), "users did not overlap"
+        if event.source.user_id == "U2":
+            u2_started.set()
+        with lock:
+            handled.append(event.webhook_event_id)
+
+    events = [make_event("U1-a", "U1"), make_event("U2-a", "U2"), make_event("U1-b", "U1")]
+    timings = make_handler(events, on_event).handle("body", "sig")
+
+    assert [e for e in handled if e.startswith("U1")] == ["U1-a", "U1-b"]
+    assert handled.index("U2-a") < handled.index("U1-a")
+    assert [t["event_id"] for t in timings] == ["U1-a", "U2-a", "U1-b"]
+
+
+def test_failing_event_lets_the_others_run_before_the_error_is_raised():
+    handled = []
+
+    def on_event(event):
+        handled.append(event.webhook_event_id)
+        if event.webhook_event_id == "U1-a":
+            raise RuntimeError("sheet down")
+
+    events = [make_event("U1-a", "U1"), make_event("U1-b", "U1"), make_event("U2-a", "U2")]
+    handler = make_handler(events, on_event)
+
+    with pytest.raises(RuntimeError, match="sheet down"):
+        handler.handle("body", "sig")
+
+    assert sorted(handled) == ["U1-a", "U1-b", "U2-a"]
+    # Only the failed event is released for redelivery.
+    handled.clear()
+    with pytest.raises(RuntimeError):
+        handler.handle("body", "sig")
+    assert handled == ["U1-a"]
+
+
+def test_sequential_mode_keeps_body_order():
+    handled = []
+    events = [make_event("U1-a", "U1"), make_event("U2-a", "U2"), make_event("U1-b", "U1")]
+    handler = make_handler(events, lambda event: handled.append(threading.current_thread()))
+
+    timings = handler.handle("body", "sig", concurrent=False)
+
+    assert set(handled) == {threading.current_thread()}
+    assert [t["event_id"] for t in timings] == ["U1-a", "U2-a", "U1-b"]